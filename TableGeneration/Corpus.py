@@ -0,0 +1,102 @@
+import os
+import numpy as np
+
+# maximum of a number cell, drawn uniformly
+NUMBER_MAXES = np.array([10, 100, 1000, 10000])
+# chance of two decimals, no decimals and a cut off number
+NUMBER_FORMAT_PROBS = [0.5, 0.35, 0.15]
+
+
+def load_courp(p, join_c=' '):
+    courp = []
+    with open(p, mode='r', encoding='utf-8') as f:
+        for line in f.readlines():
+            line = line.strip("\n").strip("\r\n")
+            courp.append(line)
+    return join_c.join(courp)
+
+
+class Corpus:
+    '''Text that cell contents are sliced from. The file is read on first use and a corpus is shared
+    by every table of the process through Corpus.get, so forked workers inherit an already loaded copy'''
+    _cache = {}
+
+    def __init__(self, path, join_c=' '):
+        self.path = path
+        self.join_c = join_c
+        self._text = None
+        self._words = None
+
+    @classmethod
+    def get(cls, path, join_c=' '):
+        '''returns the process-wide corpus of path'''
+        key = (os.path.abspath(path), join_c)
+        if key not in cls._cache:
+            cls._cache[key] = cls(path, join_c)
+        return cls._cache[key]
+
+    def __reduce__(self):
+        # pickled as its path, so tables sent to other processes do not carry the whole text
+        return Corpus.get, (self.path, self.join_c)
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = load_courp(self.path, self.join_c)
+        return self._text
+
+    def load(self):
+        '''reads the file now instead of on first use'''
+        self.text
+        return self
+
+    def word_offsets(self):
+        '''returns the start and end offsets of every word, computed on first use'''
+        if self._words is None:
+            chars = np.frombuffer(self.text.encode('utf-32-le'), dtype=np.uint32)
+            is_word = np.concatenate([[0], ~np.isin(chars, [9, 10, 13, 32]), [0]]).astype(np.int8)
+            edges = np.diff(is_word)
+            self._words = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+        return self._words
+
+    def sample(self, lengths, word_boundary=False):
+        '''returns a slice of lengths[i] characters for every i, with one NumPy call for all offsets. With
+        word_boundary a slice starts at a word and ends after the last word that fits, so only words longer
+        than the length are cut'''
+        text = self.text
+        lengths = np.minimum(np.asarray(lengths), len(text))
+        u = np.random.random(len(lengths))
+        if word_boundary:
+            word_starts, word_ends = self.word_offsets()
+            # a slice fits after the first count word starts
+            counts = np.maximum(np.searchsorted(word_starts, len(text) - lengths, side='right'), 1)
+            starts = word_starts[(u * counts).astype(int)]
+            last = np.searchsorted(word_ends, starts + lengths, side='right') - 1
+            # -1 when the slice starts at the first word of the text and that word is longer than the length
+            ends = np.where(last >= 0, word_ends[np.maximum(last, 0)], starts)
+            ends = np.where(ends > starts, ends, starts + lengths)
+        else:
+            starts = (u * (len(text) - lengths + 1)).astype(int)
+            ends = starts + lengths
+        return [text[start:end] for start, end in zip(starts.tolist(), ends.tolist())]
+
+
+def sample_numbers(money):
+    '''returns a number text for every entry of the bool array money, prefixed with $ where it is True, for
+    the number and money cells of Table.generate_texts: a maximum of 10 to 10000, then two decimals, no
+    decimals or the number cut off after its integer digits and up to 3 more characters'''
+    n = len(money)
+    max_nums = NUMBER_MAXES[np.random.randint(0, len(NUMBER_MAXES), size=n)]
+    values = (np.random.random(n) * max_nums).tolist()
+    formats = np.random.choice(len(NUMBER_FORMAT_PROBS), size=n, p=NUMBER_FORMAT_PROBS).tolist()
+    keep = (np.log10(max_nums).astype(int) + 1 + np.random.randint(0, 4, size=n)).tolist()
+    texts = []
+    for value, fmt, k, m in zip(values, formats, keep, np.asarray(money).tolist()):
+        if fmt == 0:
+            out = '%.2f' % value
+        elif fmt == 1:
+            out = '%.0f' % value
+        else:
+            out = str(value)[:k]
+        texts.append('$' + out if m else out)
+    return texts
@@ -0,0 +1,153 @@
+import itertools
+import multiprocessing as mp
+import queue
+import random
+import signal
+import sys
+import traceback
+import numpy as np
+from TableGeneration.Pipeline import pack_image, unpack_image
+
+
+def worker_indices(start, num, worker_id, num_workers):
+    '''the table indices of one of num_workers workers, endless when num is None'''
+    # islice counts positions of the iterator, not indices
+    return itertools.islice(itertools.count(start), worker_id, num, num_workers)
+
+
+def convert_image(im, as_array):
+    return np.asarray(im.convert('RGB')) if as_array else im
+
+
+def generate(build, build_args, worker_id, indices_args, sample_queue, as_array):
+    '''renders the tables of worker_indices(*indices_args) with one warm generator into sample_queue and ends
+    with (None, worker_id, error), error being None or the repr of the exception that stopped the worker'''
+    # terminating a worker closes its generator, so its browser is not left behind
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    generator = None
+    error = None
+    try:
+        generator = build(*build_args)
+        if generator.seed is None:
+            # forked workers inherit the random state of the parent, reseed so they do not create the same tables
+            random.seed()
+            np.random.seed()
+        for index in worker_indices(*indices_args):
+            sample = generator.make_sample(index)
+            if sample is None:
+                continue
+            im, label = sample
+            # the put blocks while the queue is full, so workers never run further ahead than prefetch samples
+            sample_queue.put((index, convert_image(im, True) if as_array else pack_image(im), label))
+    except Exception as e:
+        traceback.print_exc()
+        error = repr(e)
+    finally:
+        # a terminated worker skips the end marker, its consumer is gone
+        if generator is not None:
+            generator.close()
+    sample_queue.put((None, worker_id, error))
+
+
+class WorkerError(RuntimeError):
+    '''a TableDataset worker stopped before generating all of its tables'''
+
+
+class TableDataset:
+    '''Iterable of (image, label) of freshly generated tables, without writing them anywhere.
+
+    build(*build_args) must return a GenerateTable (e.g. build_generator of generate_data.py). With
+    num_workers > 0 every iteration starts that many processes, each keeping one generator and its browser warm
+    for all of its tables, and yields their samples in completion order out of a queue of at most prefetch
+    samples. With num_workers=0 the tables are generated in the iterating process, which is what a torch
+    DataLoader worker should do: the indices are then split between the DataLoader workers.
+
+    Table index i of a generator with a seed is the same table however many workers there are, labels are
+    named <border>_<i>.jpg. num=None generates endlessly. Images are PIL images, or RGB arrays with as_array.
+    A worker that fails to start, fails outside of a table or dies raises a WorkerError in the iterating
+    process instead of leaving it waiting.
+    '''
+
+    def __init__(self, build, build_args=(), num_workers=4, prefetch=16, start=0, num=None, as_array=False):
+        self.build = build
+        self.build_args = build_args
+        self.num_workers = num_workers
+        self.prefetch = prefetch
+        self.start = start
+        self.num = num
+        self.as_array = as_array
+        self.generator = None
+
+    def __len__(self):
+        if self.num is None:
+            raise TypeError('an endless TableDataset has no length')
+        return self.num
+
+    def __iter__(self):
+        if self.num_workers == 0:
+            return self.iter_local()
+        return self.iter_workers()
+
+    def iter_local(self):
+        worker_id, num_workers = 0, 1
+        try:
+            from torch.utils.data import get_worker_info
+            info = get_worker_info()
+        except ImportError:
+            info = None
+        if info is not None:
+            worker_id, num_workers = info.id, info.num_workers
+        if self.generator is None:
+            self.generator = self.build(*self.build_args)
+        for index in worker_indices(self.start, self.num, worker_id, num_workers):
+            sample = self.generator.make_sample(index)
+            if sample is not None:
+                im, label = sample
+                yield convert_image(im, self.as_array), label
+
+    def iter_workers(self):
+        sample_queue = mp.Queue(self.prefetch)
+        workers = [
+            mp.Process(target=generate,
+                       args=(self.build, self.build_args, worker_id,
+                             (self.start, self.num, worker_id, self.num_workers), sample_queue, self.as_array),
+                       daemon=True) for worker_id in range(self.num_workers)
+        ]
+        for p in workers:
+            p.start()
+        try:
+            running = set(range(len(workers)))
+            while running:
+                try:
+                    item = sample_queue.get(timeout=1)
+                except queue.Empty:
+                    # the queue is empty, so a worker that is gone has delivered everything it put
+                    for worker_id in sorted(running):
+                        exitcode = workers[worker_id].exitcode
+                        if exitcode == 0:
+                            running.discard(worker_id)
+                        elif exitcode is not None:
+                            raise WorkerError(f'table worker {worker_id} died with exit code {exitcode}')
+                    continue
+                index, im, label = item
+                if index is None:
+                    worker_id, error = im, label
+                    if error is not None:
+                        raise WorkerError(f'table worker {worker_id} failed: {error}')
+                    running.discard(worker_id)
+                    continue
+                yield (im if self.as_array else unpack_image(im)), label
+            for p in workers:
+                p.join()
+        finally:
+            # the consumer stopped early or the workers are done, either way no browser outlives the iteration
+            for p in workers:
+                if p.is_alive():
+                    p.terminate()
+            for p in workers:
+                p.join(10)
+
+    def close(self):
+        if self.generator is not None:
+            self.generator.close()
+            self.generator = None
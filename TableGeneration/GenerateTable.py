@@ -1,8 +1,12 @@
+import base64
 import json
+import math
 import os
 import sys
 import random
 import string
+import threading
+from contextlib import nullcontext
 from PIL import Image
 from io import BytesIO
 from tqdm import tqdm
@@ -12,6 +16,169 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
 from TableGeneration.Table import Table
+from TableGeneration.Corpus import Corpus
+from TableGeneration.RasterRenderer import RasterRenderer
+from TableGeneration.ShardWriter import ShardWriter
+from TableGeneration.Mask import cell_border_mask, structure_maps
+
+# blank page loaded once per browser when render_mode is 'inject'
+HARNESS_HTML = '<!DOCTYPE html><html><head><meta charset="UTF-8"></head><body></body></html>'
+
+# swaps the head (style) and body (table) of the harness page for those of a table document
+# and flushes layout once, so no navigation happens per table
+INJECT_HTML_JS = '''
+var doc = new DOMParser().parseFromString(arguments[0], 'text/html');
+document.head.innerHTML = doc.head.innerHTML;
+document.body.innerHTML = doc.body.innerHTML;
+window.scrollTo(0, 0);
+return [document.documentElement.scrollWidth, document.documentElement.scrollHeight];
+'''
+
+# size of the laid out page
+MEASURE_JS = 'return [document.documentElement.scrollWidth, document.documentElement.scrollHeight];'
+
+# swaps the font and stylesheet of the table in the page for those of another style of the same table,
+# the table elements themselves are kept
+SWAP_STYLE_JS = '''
+var font = document.body.querySelector('font');
+font.setAttribute('size', arguments[1]);
+font.setAttribute('face', arguments[2]);
+font.querySelector('style').textContent = arguments[0];
+window.scrollTo(0, 0);
+return [document.documentElement.scrollWidth, document.documentElement.scrollHeight];
+'''
+
+# collects text and page rect of the elements with id 0..n-1 in one round trip,
+# with arguments[1] also the page rect of the text spans with id t0..tn-1
+CELL_BOXES_JS = '''
+var out = [];
+for (var i = 0; i < arguments[0]; i++) {
+    var e = document.getElementById(String(i));
+    if (e === null) {
+        return null;
+    }
+    var r = e.getBoundingClientRect();
+    var item = [e.innerText, r.left + window.pageXOffset, r.top + window.pageYOffset, r.width, r.height];
+    if (arguments[1]) {
+        var t = document.getElementById('t' + String(i));
+        if (t === null) {
+            return null;
+        }
+        r = t.getBoundingClientRect();
+        item.push(r.left + window.pageXOffset, r.top + window.pageYOffset, r.width, r.height);
+    }
+    out.push(item);
+}
+return JSON.stringify(out);
+'''
+
+# puts every table document into the shadow root of its own host, so ids and <style> rules of one table do
+# not apply to the others, and lays the hosts out next to each other in one pass. Hosts are separated by
+# twice their margin, which must be at least the clip_white padding
+INJECT_TILES_JS = '''
+var page = document.createElement('div');
+page.style.cssText = 'display:flex;flex-wrap:wrap;align-items:flex-start;';
+for (var k = 0; k < arguments[0].length; k++) {
+    var doc = new DOMParser().parseFromString(arguments[0][k], 'text/html');
+    var host = document.createElement('div');
+    host.style.cssText = 'margin:' + arguments[1] + 'px;';
+    host.attachShadow({mode: 'open'}).innerHTML = doc.head.innerHTML + doc.body.innerHTML;
+    page.appendChild(host);
+}
+document.head.innerHTML = '';
+document.body.innerHTML = '';
+document.body.appendChild(page);
+window.scrollTo(0, 0);
+var r = page.getBoundingClientRect();
+return [r.left + window.pageXOffset, r.top + window.pageYOffset, page.scrollWidth, page.scrollHeight];
+'''
+
+# CELL_BOXES_JS for every tile, a tile with a missing id is null
+TILE_BOXES_JS = '''
+var hosts = document.body.firstChild.children;
+var out = [];
+for (var k = 0; k < hosts.length; k++) {
+    var root = hosts[k].shadowRoot;
+    var cells = [];
+    for (var i = 0; i < arguments[0][k]; i++) {
+        var e = root.getElementById(String(i));
+        if (e === null) {
+            cells = null;
+            break;
+        }
+        var r = e.getBoundingClientRect();
+        var item = [e.innerText, r.left + window.pageXOffset, r.top + window.pageYOffset, r.width, r.height];
+        if (arguments[1]) {
+            var t = root.getElementById('t' + String(i));
+            if (t === null) {
+                cells = null;
+                break;
+            }
+            r = t.getBoundingClientRect();
+            item.push(r.left + window.pageXOffset, r.top + window.pageYOffset, r.width, r.height);
+        }
+        cells.push(item);
+    }
+    out.push(cells);
+}
+return JSON.stringify(out);
+'''
+
+# padding (x, y) clip_white keeps around the boxes of each box type
+CLIP_PADDING = {'cell': (5, 5), 'text': (40, 20)}
+
+# margin around every tile, at least the largest clip_white padding
+TILE_MARGIN = 40
+
+# targets save_sample can write next to the images
+TARGETS = ('mask', 'row', 'col', 'span')
+
+class RenderTimeout(Exception):
+    '''a render did not finish within render_timeout and its browser was killed'''
+
+
+class TableTooLarge(Exception):
+    '''a laid out table does not fit the max_page_width x max_page_height cap and is dropped'''
+
+
+# environment variable inherited by the workers, drivers and browsers of a run, see mark_run
+RUN_ENV = 'TABLEGEN_RUN_ID'
+
+
+def mark_run(run_id):
+    '''tags every process started from now on, workers and the drivers and browsers they start, with run_id'''
+    os.environ[RUN_ENV] = run_id
+
+
+def reap_orphan_browsers(run_id):
+    '''kills drivers and automated headless browsers of run_id (see mark_run) whose parent is no longer a live
+    process of the run, they are left behind by killed workers and were reparented to init or a subreaper;
+    processes of other runs and users are left alone. Called from the main process of the run, its descendants
+    are the live processes. Returns the number of killed processes'''
+    import psutil
+    me = psutil.Process()
+    live = {me.pid} | {p.pid for p in me.children(recursive=True)}
+    killed = []
+    for proc in psutil.process_iter(['ppid', 'name', 'cmdline']):
+        try:
+            if proc.info['ppid'] in live:
+                continue
+            name = proc.info['name'] or ''
+            cmdline = proc.info['cmdline'] or []
+            automated = ('--enable-automation' in cmdline or '-marionette' in cmdline) and (
+                '--headless' in cmdline or '-headless' in cmdline)
+            if not (name in ('chromedriver', 'geckodriver') or automated):
+                continue
+            if proc.environ().get(RUN_ENV) != run_id:
+                continue
+            procs = proc.children(recursive=True) + [proc]
+            for p in procs:
+                p.kill()
+            killed += procs
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    psutil.wait_procs(killed, timeout=5)
+    return len(killed)
 
 
 class GenerateTable:
@@ -35,11 +202,33 @@ class GenerateTable:
                  browser='chrome',
                  browser_width=1920,
                  browser_height=1920,
-                 border_type='full'):
+                 border_type='full',
+                 max_tables_per_browser=0,
+                 max_browser_rss=0,
+                 extract_mode='batch',
+                 render_mode='inject',
+                 screenshot_mode='clip',
+                 screenshot_format='png',
+                 renderer='browser',
+                 font_path=None,
+                 bold_font_path=None,
+                 output_format='files',
+                 max_shard_size=1024,
+                 seed=None,
+                 render_timeout=0,
+                 tiles_per_page=1,
+                 style_variants=1,
+                 word_boundary=False,
+                 max_page_width=0,
+                 max_page_height=0,
+                 targets=(),
+                 render_server=None):
         self.output = output  # wheter to store images separately or not
         self.ch_dict_path = ch_dict_path
         self.en_dict_path = en_dict_path
-        self.cell_box_type = cell_box_type  # cell: use cell location as cell box; text: use location of text in cell as cell box
+        self.ch_corpus = Corpus.get(ch_dict_path)
+        self.en_corpus = Corpus.get(en_dict_path)
+        self.cell_box_type = cell_box_type  # cell: use cell location as cell box; text: use location of text in cell as cell box; both: cell and text box
         self.min_row = min_row  # minimum number of rows in a table (includes headers)
         self.max_row = max_row  # maximum number of rows in a table
         self.min_col = min_col  # minimum number of columns in a table
@@ -56,7 +245,50 @@ class GenerateTable:
         self.browser_height = browser_height  # browser height
         self.browser_width = browser_width  # browser width
         self.border_type = border_type
+        self.max_tables_per_browser = max_tables_per_browser  # restart browser after rendering this many tables, 0: never
+        self.max_browser_rss = max_browser_rss  # restart browser once its processes use more than this many MB, 0: never
+        assert extract_mode in ['batch', 'element'], "extract_mode must in ['batch', 'element']"
+        self.extract_mode = extract_mode  # batch: read all cell boxes with one script; element: query cells one by one
+        assert render_mode in ['inject', 'navigate'], "render_mode must in ['inject', 'navigate']"
+        self.render_mode = render_mode  # inject: swap tables into one harness page; navigate: load every table as a data url
+        assert screenshot_mode in ['clip', 'full'], "screenshot_mode must in ['clip', 'full']"
+        self.screenshot_mode = screenshot_mode  # clip: capture only the padded table region (chrome); full: capture the window
+        assert screenshot_format in ['png', 'jpeg'], "screenshot_format must in ['png', 'jpeg']"
+        self.screenshot_format = screenshot_format  # encoding of clipped captures, jpeg captures are written without re-encoding
+
+        assert renderer in ['browser', 'raster'], "renderer must in ['browser', 'raster']"
+        self.renderer = renderer  # browser: render html with selenium; raster: lay out and draw the table with PIL
+        self.raster_renderer = RasterRenderer(cell_box_type, browser_width, browser_height, font_path,
+                                              bold_font_path, max_page_width,
+                                              max_page_height) if renderer == 'raster' else None
+
+        assert output_format in ['files', 'shards'], "output_format must in ['files', 'shards']"
+        self.output_format = output_format  # files: img/html/json files per table; shards: tar and jsonl shards
+        self.max_shard_size = max_shard_size  # MB per tar shard
+        self.shard_writer = None
+        self.seed = seed  # when set, every table index derives its own random state from it
+        self.metrics = None  # Metrics collecting stage durations and counters, None: not instrumented
+        self.render_timeout = render_timeout  # seconds a browser render may take before the browser is killed, 0: no limit
+        self.browser_killed = False
+        self.last_error = None  # exception type of the last failed table
+        self.tiles_per_page = tiles_per_page  # tables the browser renders on one page with one screenshot
+        self.style_variants = style_variants  # styles every created table is rendered with
+        self.word_boundary = word_boundary  # cut cell texts from the corpora at word boundaries
+        # largest page a table may lay out to, 0: the browser size. Tables are laid out browser_width wide,
+        # wider tables in a wider window up to the cap
+        self.max_page_width = max_page_width or browser_width
+        self.max_page_height = max_page_height or browser_height
+        assert set(targets) <= set(TARGETS), f"targets must be in {list(TARGETS)}"
+        self.targets = tuple(targets)  # training targets written next to every image, see make_targets
+        self.render_server = render_server  # address of a RenderServer rendering the tables instead of a browser of our own
+        self.render_client = None
 
+        # the browser is started on the first render, so generators that only create or write tables never start one
+        self.driver = None
+        self.tables_since_start = 0
+
+    def start_browser(self):
+        '''starts a headless browser, it is reused for every table until closed or recycled'''
         if self.browser == 'chrome':
             from selenium.webdriver import Chrome as Browser
             from selenium.webdriver import ChromeOptions as Options
@@ -67,52 +299,184 @@ class GenerateTable:
         opts.add_argument('--headless')
         opts.add_argument('--no-sandbox')
         self.driver = Browser(options=opts)
+        self.tables_since_start = 0
+        if self.render_mode == 'inject':
+            self.driver.get(f"data:text/html;charset=utf-8,{HARNESS_HTML}")
+        self.window_size = self.resize_window()
 
-    def gen_table_img(self, img_count):
-        os.makedirs(self.output, exist_ok=True)
-        
-        for index in tqdm(range(img_count)):
-            # data_arr contains the images of generated tables and all_table_categories contains the table category of each of the table
-            out = self.generate_table()
-            if out is None:
-                continue
+    def resize_window(self):
+        self.driver.maximize_window()
+        self.driver.set_window_size(
+            width=self.browser_width,
+            height=self.browser_height,
+            windowHandle="current")
+        return self.driver.get_window_size()
 
-            im, html_content, structure, contens, border = out
-            im, contens = self.clip_white(im, contens)
+    def set_window(self, width, height):
+        self.driver.set_window_size(width=width, height=height, windowHandle="current")
+        self.window_size = self.driver.get_window_size()
 
-            output_file_name = f'{border}_{index}'
+    @property
+    def clip_capture(self):
+        '''whether screenshots capture page regions (also outside the window) instead of the window'''
+        return self.screenshot_mode == 'clip' and self.browser == 'chrome'
 
-            # if the image and equivalent html is need to be stored
-            os.makedirs(os.path.join(self.output, 'html'), exist_ok=True)
-            os.makedirs(os.path.join(self.output, 'img'), exist_ok=True)
+    def fit_window(self, page_size):
+        '''checks the size (width, height) of the laid out page against the cap and returns the page size.
+        A page wider than the window is laid out again in a window as wide as the page, and for window
+        screenshots the window height follows the page, which does not change the layout'''
+        width, height = page_size
+        for _ in range(3):
+            # a table laid out wider can grow again, until it fits its window
+            if not self.window_size['width'] < width <= self.max_page_width:
+                break
+            self.set_window(width, self.window_size['height'])
+            width, height = self.driver.execute_script(MEASURE_JS)
+        if width > self.max_page_width or height > self.max_page_height:
+            raise TableTooLarge(f'page of {width}x{height} exceeds {self.max_page_width}x{self.max_page_height}')
+        if not self.clip_capture:
+            window_height = self.window_size['height']
+            if height > window_height or height < window_height // 2:
+                self.set_window(self.window_size['width'], height)
+            if width > self.window_size['width'] or height > self.window_size['height']:
+                # the browser refused a window this large
+                raise TableTooLarge(f'page of {width}x{height} exceeds the window of {self.window_size}')
+        return width, height
 
-            html_save_path = os.path.join(self.output, 'html', f'{output_file_name}.html')
-            img_save_path = os.path.join(self.output, 'img', f'{output_file_name}.jpg')
-            # with open(html_save_path, encoding='utf-8', mode='w') as f:
-            #     f.write(html_content)
-            im.save(img_save_path, dpi=(300, 300), quality=95)
+    def restore_window_width(self):
+        '''tables are laid out browser_width wide, a window widened for an earlier table is narrowed again'''
+        if self.window_size['width'] != self.browser_width:
+            self.set_window(self.browser_width, self.window_size['height'])
 
-            img_file_name = os.path.join('img', f'{output_file_name}.jpg')
-            label_info = self.make_ppstructure_label(structure, contens,
-                                                        img_file_name)
-            output_label_dir = os.path.join(self.output, 'json')
-            os.makedirs(output_label_dir, exist_ok=True)
-            output_label_path = os.path.join(output_label_dir, f"{border}_{index}.json")
+    def restart_browser(self, reason='recycle'):
+        self.count('browser_restarts_total', reason=reason)
+        self.close()
+        self.start_browser()
 
-            with open(output_label_path, "w") as f:
-                json.dump(label_info, f, ensure_ascii=False, indent=4)
+    def browser_rss(self):
+        '''returns the resident memory (MB) of the driver process and every browser process it spawned'''
+        import psutil
+        service = getattr(self.driver, 'service', None)
+        if service is None or service.process is None:
+            return 0
+        try:
+            root = psutil.Process(service.process.pid)
+            procs = [root] + root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return 0
+        rss = 0
+        for proc in procs:
+            try:
+                rss += proc.memory_info().rss
+            except psutil.NoSuchProcess:
+                continue
+        return rss / 1024 / 1024
+
+    def recycle_browser(self, tables=1):
+        '''restarts the browser when it has rendered too many tables or grown too large'''
+        if self.driver is None:
+            return
+        self.tables_since_start += tables
+        if self.max_tables_per_browser > 0 and self.tables_since_start >= self.max_tables_per_browser:
+            self.restart_browser('tables')
+        elif self.max_browser_rss > 0 and self.browser_rss() > self.max_browser_rss:
+            self.restart_browser('rss')
+
+    @property
+    def tiled(self):
+        return (self.tiles_per_page > 1 and self.raster_renderer is None and self.render_server is None
+                and self.style_variants == 1)
+
+    def gen_table_img(self, img_count, indices=None):
+        os.makedirs(self.output, exist_ok=True)
+        indices = range(img_count) if indices is None else indices
+        if self.tiled:
+            with tqdm(total=len(indices)) as progress:
+                for start in range(0, len(indices), self.tiles_per_page):
+                    batch = indices[start:start + self.tiles_per_page]
+                    for index, (out, _) in zip(batch, self.generate_tables(batch)):
+                        if out is not None:
+                            self.save_sample(index, out, save_html=False, quality=95)
+                    progress.update(len(batch))
+            self.close()
+            return
+
+        for index in tqdm(indices):
+            if self.style_variants > 1:
+                self.seed_index(index)
+                self.save_variants(index, self.generate_variants(), save_html=False, quality=95)
+                continue
+            # data_arr contains the images of generated tables and all_table_categories contains the table category of each of the table
+            self.seed_index(index)
+            out = self.generate_table()
+            if out is None:
+                continue
+            self.save_sample(index, out, save_html=False, quality=95)
 
         self.close()
 
     def gen_table_img_single(self, index: int):
+        '''generates and writes one table, returns None or the exception type it failed with'''
+        self.seed_index(index)
+        self.last_error = None
+        if self.style_variants > 1:
+            outs = self.generate_variants()
+            self.save_variants(index, outs, save_html=True)
+            return self.last_error if len(outs) < self.style_variants else None
         out = self.generate_table()
         if out is None:
-            return
+            return self.last_error
+        self.save_sample(index, out, save_html=True)
+        return None
+
+    def save_variants(self, index, outs, **save_kwargs):
+        '''writes the style variants of a table as <border>_<index>_v<k>'''
+        for k, out in enumerate(outs):
+            self.save_sample(index, out, suffix=f'_v{k}', **save_kwargs)
+
+    def gen_table_img_batch(self, indices):
+        '''generates and writes tables tiled on one page, returns (index, None or the exception type it failed
+        with) of every index'''
+        results = []
+        for index, (out, error) in zip(indices, self.generate_tables(indices)):
+            if out is not None:
+                self.save_sample(index, out, save_html=True)
+            results.append((index, error))
+        return results
+
+    def make_sample(self, index):
+        '''generates one table in memory, returns its clipped image and label or None when it failed'''
+        self.seed_index(index)
+        out = self.generate_table()
+        if out is None:
+            return None
+        im, html_content, structure, contens, border = out
+        with self.time_stage('clip_white'):
+            im, contens = self.clip_white(im, contens)
+        return im, self.make_ppstructure_label(structure, contens, f'{border}_{index}.jpg')
 
+    def save_sample(self, index, out, save_html=True, suffix='', **save_kwargs):
+        '''clips a generated table and writes its image, html and label'''
         im, html_content, structure, contens, border = out
-        im, contens = self.clip_white(im, contens)
+        with self.time_stage('clip_white'):
+            im, contens = self.clip_white(im, contens)
+
+        output_file_name = f'{border}_{index}{suffix}'
 
-        output_file_name = f'{border}_{index}'
+        with self.time_stage('encode'):
+            img_bytes = self.encode_image(im, dpi=(300, 300), **save_kwargs)
+
+        with self.time_stage('targets'):
+            targets = self.make_targets(im.size, structure, contens)
+
+        if self.output_format == 'shards':
+            with self.time_stage('write'):
+                label_info = self.make_ppstructure_label(structure, contens, f'{output_file_name}.jpg')
+                extra = {f'{target}.png': target_bytes for target, target_bytes in targets.items()}
+                written = self.get_shard_writer().write(output_file_name, img_bytes, label_info, extra)
+            self.count('tables_written_total')
+            self.count('bytes_written_total', written)
+            return
 
         # if the image and equivalent html is need to be stored
         os.makedirs(os.path.join(self.output, 'html'), exist_ok=True)
@@ -120,46 +484,210 @@ class GenerateTable:
 
         html_save_path = os.path.join(self.output, 'html', f'{output_file_name}.html')
         img_save_path = os.path.join(self.output, 'img', f'{output_file_name}.jpg')
-        with open(html_save_path, encoding='utf-8', mode='w') as f:
-            f.write(html_content)
-        im.save(img_save_path, dpi=(300, 300))
+        with self.time_stage('write'):
+            written = len(img_bytes)
+            if save_html:
+                with open(html_save_path, encoding='utf-8', mode='w') as f:
+                    f.write(html_content)
+                written += len(html_content.encode('utf-8'))
+            with open(img_save_path, 'wb') as f:
+                f.write(img_bytes)
+            for target, target_bytes in targets.items():
+                os.makedirs(os.path.join(self.output, target), exist_ok=True)
+                with open(os.path.join(self.output, target, f'{output_file_name}.png'), 'wb') as f:
+                    f.write(target_bytes)
+                written += len(target_bytes)
 
-        img_file_name = os.path.join('img', f'{output_file_name}.jpg')
-        label_info = self.make_ppstructure_label(structure, contens, img_file_name)
-        output_label_dir = os.path.join(self.output, 'json')
-        os.makedirs(output_label_dir, exist_ok=True)
-        output_label_path = os.path.join(output_label_dir, f"{border}_{index}.json")
+            img_file_name = os.path.join('img', f'{output_file_name}.jpg')
+            label_info = self.make_ppstructure_label(structure, contens, img_file_name)
+            output_label_dir = os.path.join(self.output, 'json')
+            os.makedirs(output_label_dir, exist_ok=True)
+            output_label_path = os.path.join(output_label_dir, f"{output_file_name}.json")
 
-        with open(output_label_path, "w") as f:
-            json.dump(label_info, f, ensure_ascii=False, indent=4)
+            label = json.dumps(label_info, ensure_ascii=False, indent=4)
+            with open(output_label_path, "w") as f:
+                f.write(label)
+            written += len(label.encode('utf-8'))
+        self.count('tables_written_total')
+        self.count('bytes_written_total', written)
 
-    def generate_table(self):
+    def make_targets(self, size, structure, contens):
+        '''Rasterizes the targets of a clipped table from its boxes, so they always match the label, and returns
+        their png bytes by name: mask is the cell border mask create_mask.py writes, row and col hold the first
+        row and column of every cell plus one as 16 bit pngs, span marks the cells spanning several rows or
+        columns'''
+        if not self.targets:
+            return {}
+        width, height = size
+        boxes = [x[2] for x in contens]
+        maps = {}
+        if 'mask' in self.targets:
+            maps['mask'] = cell_border_mask(boxes, width, height)
+        if set(self.targets) & {'row', 'col', 'span'}:
+            maps.update(structure_maps(boxes, structure, width, height))
+        targets = {}
+        for target in self.targets:
+            buffer = BytesIO()
+            Image.fromarray(maps[target]).save(buffer, format='PNG')
+            targets[target] = buffer.getvalue()
+        return targets
+
+    def time_stage(self, stage):
+        '''times a stage when Metrics are attached'''
+        if self.metrics is None:
+            return nullcontext()
+        return self.metrics.time(stage)
+
+    def count(self, name, value=1, **labels):
+        if self.metrics is not None:
+            self.metrics.inc(name, value, **labels)
+
+    def record_failure(self, error):
+        '''prints and counts a table that could not be generated, by exception type'''
+        import traceback
+        traceback.print_exc()
+        self.last_error = type(error).__name__
+        self.count('tables_failed_total', exception=self.last_error)
+
+    def get_shard_writer(self):
+        if self.shard_writer is None:
+            # one writer per process, its shards are named after the pid
+            self.shard_writer = ShardWriter(os.path.join(self.output, 'shards'), f'{self.border_type}_{os.getpid()}',
+                                            self.max_shard_size)
+        return self.shard_writer
+
+    def gen_table_structure(self, index: int):
+        '''creates a table without rendering it and returns its label, with cell texts but without boxes'''
+        self.seed_index(index)
+        table = self.create_table()
+        id_count, html_content, structure, border = table.create()
+        label_info = {
+            'filename': f'{border}_{index}',
+            'html': {
+                'structure': {
+                    'tokens': structure
+                },
+                'cells': [{'tokens': list(txt)} for txt in table.cell_texts]
+            }
+        }
+        label_info['gt'] = self.rebuild_html_from_ppstructure_label(label_info)
+        return label_info
+
+    def seed_index(self, index):
+        '''seeds random and np.random from the run seed and the table index, so a table does not depend on
+        which worker creates it or what it created before'''
+        if self.seed is None:
+            return
+        state = np.random.SeedSequence([self.seed, index]).generate_state(2)
+        random.seed(int(state[0]))
+        np.random.seed(int(state[1]))
+
+    def create_table(self):
+        '''returns a Table of random size with the settings of this generator'''
         cols = random.randint(self.min_col, self.max_col)
         rows = random.randint(self.min_row, self.max_row)
+        return Table(self.ch_corpus, self.en_corpus,
+                     self.cell_box_type, rows, cols, self.min_txt_len,
+                     self.max_txt_len, self.max_span_row_count,
+                     self.max_span_col_count, self.max_span_value,
+                     self.color_prob, self.cell_max_width,
+                     self.cell_max_height, border_type=self.border_type,
+                     word_boundary=self.word_boundary)
+
+    def generate_table(self):
         try:
             # initialize table class
-            table = Table(self.ch_dict_path, self.en_dict_path,
-                          self.cell_box_type, rows, cols, self.min_txt_len,
-                          self.max_txt_len, self.max_span_row_count,
-                          self.max_span_col_count, self.max_span_value,
-                          self.color_prob, self.cell_max_width,
-                          self.cell_max_height, border_type=self.border_type)
-            # get table of rows and cols based on unlv distribution and get features of this table
-            # (same row, col and cell matrices, total unique ids, html conversion of table and its category)
-            id_count, html_content, structure, border = table.create()
+            with self.time_stage('table_create'):
+                table = self.create_table()
+                # get table of rows and cols based on unlv distribution and get features of this table
+                # (same row, col and cell matrices, total unique ids, html conversion of table and its category)
+                id_count, html_content, structure, border = table.create()
 
             # convert this html code to image using selenium webdriver. Get equivalent bounding boxes
             # for each word in the table. This will generate ground truth for our problem
             
-            im, contens = self.html_to_img(html_content, id_count)
+            im, contens = self.render_table(table, html_content, id_count)
             return im, html_content, structure, contens, border
         except KeyboardInterrupt:
             import sys
             sys.exit()
-        except Exception:
-            import traceback
-            traceback.print_exc()
+        except Exception as e:
+            self.record_failure(e)
             return None
+        finally:
+            self.recycle_browser()
+
+    def generate_variants(self):
+        '''creates one table and renders it under style_variants styles, the first being the style it was
+        created with; returns the outs of the rendered variants, which share structure and texts'''
+        outs = []
+        try:
+            with self.time_stage('table_create'):
+                table = self.create_table()
+                id_count, html_content, structure, border = table.create()
+            for k in range(self.style_variants):
+                if k == 0:
+                    im, contens = self.render_table(table, html_content, id_count)
+                else:
+                    with self.time_stage('restyle'):
+                        html_content = table.restyle()
+                    if self.raster_renderer is not None:
+                        with self.time_stage('raster_render'):
+                            im, contens = self.raster_renderer.render(table)
+                    elif self.render_server is not None:
+                        # the page of the first variant is not ours to restyle
+                        im, contens = self.render_table(table, html_content, id_count)
+                    else:
+                        im, contens = self.run_with_watchdog(self.restyle_page, table, id_count)
+                outs.append((im, html_content, structure, contens, border))
+        except KeyboardInterrupt:
+            sys.exit()
+        except Exception as e:
+            self.record_failure(e)
+        finally:
+            # the page must stay loaded until the last variant is captured
+            self.recycle_browser(max(len(outs), 1))
+        return outs
+
+    def generate_tables(self, indices):
+        '''creates the tables of indices and renders them tiled on one page,
+        returns (out, None) or (None, exception type) of every index'''
+        created = []
+        errors = {}
+        for index in indices:
+            self.seed_index(index)
+            self.last_error = None
+            try:
+                with self.time_stage('table_create'):
+                    table = self.create_table()
+                    created.append((index, table.create()))
+            except Exception as e:
+                self.record_failure(e)
+                errors[index] = self.last_error
+
+        rendered = [None] * len(created)
+        if created:
+            try:
+                rendered = self.run_with_watchdog(self.html_to_tiles, [sample for _, sample in created])
+            except Exception as e:
+                self.record_failure(e)
+                errors.update((index, self.last_error) for index, _ in created)
+            finally:
+                self.recycle_browser(len(created))
+
+        outs = {}
+        for (index, sample), tile in zip(created, rendered):
+            id_count, html_content, structure, border = sample
+            if isinstance(tile, TableTooLarge):
+                # already recorded by html_to_pages
+                errors[index] = type(tile).__name__
+            elif tile is not None:
+                outs[index] = tile[0], html_content, structure, tile[1], border
+            elif index not in errors:
+                # missing cell ids or a tile outside the captured page
+                errors[index] = 'TileError'
+                self.count('tables_failed_total', exception='TileError')
+        return [(outs.get(index), errors.get(index)) for index in indices]
 
     def make_ppstructure_label(self, structure, bboxes, img_path):
         d = {
@@ -170,7 +698,11 @@ class GenerateTable:
                 }
             }
         }
-        cells = [{'tokens': list(bbox[1]), 'bbox': bbox[2:]} for bbox in bboxes]
+        cells = [{'tokens': list(bbox[1]), 'bbox': bbox[2:3]} for bbox in bboxes]
+        if self.cell_box_type == 'both':
+            # bbox holds the cell box, text_bbox the box of its text
+            for cell, bbox in zip(cells, bboxes):
+                cell['text_bbox'] = bbox[3:4]
         d['html']['cells'] = cells
         d['gt'] = self.rebuild_html_from_ppstructure_label(d)
         return d
@@ -192,49 +724,272 @@ class GenerateTable:
         html_code = ''.join(html_code)
         return f'<html><body><table>{html_code}</table></body></html>'
 
-    def clip_white(self, im, bboxes):
-        w, h = im.size
-        bbox = np.array([x[2] for x in bboxes])
-        xmin = bbox[:, :, 0].min()
-        ymin = bbox[:, :, 1].min()
-        xmax = bbox[:, :, 0].max()
-        ymax = bbox[:, :, 1].max()
-        
+    def clip_region(self, bboxes, w, h):
+        '''returns the padded region around all boxes, clamped to a w x h image. With both box types every
+        box set keeps at least its own padding'''
+        bbox = np.array([x[2:] for x in bboxes])
+        box_types = ['cell', 'text'] if self.cell_box_type == 'both' else [self.cell_box_type]
+        pads = np.array([CLIP_PADDING[box_type] for box_type in box_types])
+        xmin = (bbox[:, :, :, 0].min(axis=(0, 2)) - pads[:, 0]).min()
+        ymin = (bbox[:, :, :, 1].min(axis=(0, 2)) - pads[:, 1]).min()
+        xmax = (bbox[:, :, :, 0].max(axis=(0, 2)) + pads[:, 0]).max()
+        ymax = (bbox[:, :, :, 1].max(axis=(0, 2)) + pads[:, 1]).max()
+
         # Random crop padding
         # xmin = max(0, xmin - random.randint(0, 10))
         # ymin = max(0, ymin - random.randint(0, 10))
         # xmax = min(w, xmax + random.randint(2, 10))
         # ymax = min(h, ymax + random.randint(2, 10))
-        
+
         # Crop fit bounding box:
-        if self.cell_box_type == 'cell':
-            xmin = max(0, xmin - 5)
-            ymin = max(0, ymin - 5)
-            xmax = min(w, xmax + 5)
-            ymax = min(h, ymax + 5)
-        elif self.cell_box_type == 'text':
-            xmin = max(0, xmin - 40)
-            ymin = max(0, ymin - 20)
-            xmax = min(w, xmax + 40)
-            ymax = min(h, ymax + 20)
-        im = im.crop([xmin, ymin, xmax, ymax])
-
-        bbox[:, :, 0] -= xmin
-        bbox[:, :, 1] -= ymin
-        for item, box in zip(bboxes, bbox):
-            item[2] = box.tolist()
+        xmin = max(0, xmin)
+        ymin = max(0, ymin)
+        xmax = min(w, xmax)
+        ymax = min(h, ymax)
+        return int(xmin), int(ymin), int(xmax), int(ymax)
+
+    def shift_boxes(self, bboxes, dx, dy):
+        bbox = np.array([x[2:] for x in bboxes])
+        bbox[..., 0] -= dx
+        bbox[..., 1] -= dy
+        for item, boxes in zip(bboxes, bbox):
+            item[2:] = boxes.tolist()
+        return bboxes
+
+    def clip_white(self, im, bboxes):
+        w, h = im.size
+        xmin, ymin, xmax, ymax = self.clip_region(bboxes, w, h)
+        # clipped screenshots already cover exactly this region
+        if (xmin, ymin, xmax, ymax) != (0, 0, w, h):
+            im = im.crop([xmin, ymin, xmax, ymax])
+        bboxes = self.shift_boxes(bboxes, xmin, ymin)
         return im, bboxes
 
+    def render_table(self, table, html_content, id_count):
+        '''renders a created table with the configured renderer, returns the image and its cell boxes'''
+        if self.raster_renderer is not None:
+            with self.time_stage('raster_render'):
+                return self.raster_renderer.render(table)
+        if self.render_server is not None:
+            from TableGeneration.RenderServer import RenderClient
+            if self.render_client is None:
+                self.render_client = RenderClient(self.render_server)
+            with self.time_stage('remote_render'):
+                return self.render_client.render(html_content, id_count, self.cell_box_type)
+        return self.run_with_watchdog(self.html_to_img, html_content, id_count)
+
+    def run_with_watchdog(self, render, *args):
+        '''runs a browser render, killing the browser when it takes longer than render_timeout'''
+        if self.render_timeout <= 0:
+            return render(*args)
+
+        # the watchdog kills a wedged browser, which makes the blocked driver call fail instead of hanging
+        self.browser_killed = False
+        watchdog = threading.Timer(self.render_timeout, self.kill_browser)
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            return render(*args)
+        except Exception:
+            if self.browser_killed:
+                raise RenderTimeout(f'render took longer than {self.render_timeout}s') from None
+            raise
+        finally:
+            watchdog.cancel()
+            if self.browser_killed:
+                # the killed browser cannot be quit, the next render starts a new one
+                self.driver = None
+                self.count('browser_restarts_total', reason='watchdog')
+
+    def kill_browser(self):
+        '''kills the driver process and every browser process it started'''
+        import psutil
+        self.browser_killed = True
+        service = getattr(self.driver, 'service', None)
+        if service is None or service.process is None:
+            return
+        try:
+            root = psutil.Process(service.process.pid)
+            procs = root.children(recursive=True) + [root]
+        except psutil.NoSuchProcess:
+            return
+        for proc in procs:
+            try:
+                proc.kill()
+            except psutil.NoSuchProcess:
+                continue
+        psutil.wait_procs(procs, timeout=5)
+
     def html_to_img(self, html_content, id_count):
         '''converts html to image'''
-        self.driver.get(f"data:text/html;charset=utf-8,{html_content}")
-        self.driver.maximize_window()
-        self.driver.set_window_size(
-            width=self.browser_width,
-            height=self.browser_height,
-            windowHandle="current")
-        window_size = self.driver.get_window_size()
-        max_height, max_width = window_size['height'], window_size['width']
+        if self.driver is None:
+            with self.time_stage('browser_start'):
+                self.start_browser()
+        with self.time_stage('navigation'):
+            self.restore_window_width()
+            if self.render_mode == 'inject':
+                page_size = self.driver.execute_script(INJECT_HTML_JS, html_content)
+            else:
+                self.driver.get(f"data:text/html;charset=utf-8,{html_content}")
+                page_size = self.driver.execute_script(MEASURE_JS)
+            page_size = self.fit_window(page_size)
+        return self.capture_table(id_count, page_size)
+
+    def restyle_page(self, table, id_count):
+        '''captures the table in the page again under the style table.restyle drew'''
+        with self.time_stage('navigation'):
+            self.restore_window_width()
+            page_size = self.driver.execute_script(SWAP_STYLE_JS, table.css, table.font_size, table.font_face)
+            page_size = self.fit_window(page_size)
+        return self.capture_table(id_count, page_size)
+
+    def capture_table(self, id_count, page_size):
+        '''reads the cell boxes of the table in the page and screenshots it'''
+        max_height, max_width = self.window_size['height'], self.window_size['width']
+        with self.time_stage('element_lookup'):
+            if self.extract_mode == 'batch':
+                contens = self.get_cell_boxes(id_count)
+            else:
+                contens = self.get_cell_boxes_by_element(id_count)
+
+        with self.time_stage('screenshot'):
+            if self.clip_capture and contens:
+                # capture only the part of the page clip_white would keep
+                region = self.clip_region(contens, *page_size)
+                im = self.capture_region(region, beyond_viewport=region[2] > max_width or region[3] > max_height)
+                contens = self.shift_boxes(contens, region[0], region[1])
+                return im, contens
+
+            png = self.driver.get_screenshot_as_png()
+
+            im = Image.open(BytesIO(png)).convert('RGB')
+            im = im.crop((0, 0, max_width, max_height))
+        return im, contens
+
+    def html_to_tiles(self, samples):
+        '''renders the (id_count, html_content, ...) samples of several tables on one page with one screenshot
+        and slices it, returns (im, contens) of every table or None for tables that could not be rendered. A page
+        larger than max_page_width x max_page_height falls back to html_to_pages'''
+        if self.driver is None:
+            with self.time_stage('browser_start'):
+                self.start_browser()
+        with self.time_stage('navigation'):
+            self.restore_window_width()
+            if self.render_mode == 'navigate':
+                self.driver.get(f"data:text/html;charset=utf-8,{HARNESS_HTML}")
+            page_x, page_y, page_w, page_h = self.driver.execute_script(
+                INJECT_TILES_JS, [sample[1] for sample in samples], TILE_MARGIN)
+            # the tiles wrap at the window width, so only the page height grows with more tiles
+            try:
+                self.fit_window((math.ceil(page_x + page_w), math.ceil(page_y + page_h)))
+                too_large = False
+            except TableTooLarge:
+                # one tall table or the tables together, a table that fits its own page is not lost with them
+                too_large = True
+        if too_large:
+            return self.html_to_pages(samples)
+        with self.time_stage('element_lookup'):
+            tiles = json.loads(self.driver.execute_script(TILE_BOXES_JS, [sample[0] for sample in samples],
+                                                          self.cell_box_type == 'both'))
+
+        with self.time_stage('screenshot'):
+            if self.clip_capture:
+                # one capture of the whole page, also the part below the window
+                region = (int(page_x), int(page_y), int(page_x + page_w), int(page_y + page_h))
+                page = self.capture_region(region, beyond_viewport=True).convert('RGB')
+                dx, dy = region[:2]
+            else:
+                page = Image.open(BytesIO(self.driver.get_screenshot_as_png())).convert('RGB')
+                dx = dy = 0
+
+        out = []
+        for rects in tiles:
+            if not rects:
+                out.append(None)
+                continue
+            contens = self.shift_boxes(self.rects_to_contens(rects), dx, dy)
+            bbox = np.array([x[2:] for x in contens])
+            if bbox[..., 0].max() > page.width or bbox[..., 1].max() > page.height:
+                out.append(None)
+                continue
+            region = self.clip_region(contens, page.width, page.height)
+            out.append((page.crop(region), self.shift_boxes(contens, region[0], region[1])))
+        return out
+
+    def html_to_pages(self, samples):
+        '''renders (id_count, html_content, ...) samples one page each like html_to_img. A table too large for its own
+        page is recorded and its TableTooLarge takes the place of its (image, contens)'''
+        out = []
+        for sample in samples:
+            try:
+                out.append(self.html_to_img(sample[1], sample[0]))
+            except TableTooLarge as e:
+                self.record_failure(e)
+                out.append(e)
+        return out
+
+    def execute_cdp_cmd(self, cmd, params):
+        '''sends a DevTools command to chrome, also for selenium versions without WebDriver.execute_cdp_cmd'''
+        if hasattr(self.driver, 'execute_cdp_cmd'):
+            return self.driver.execute_cdp_cmd(cmd, params)
+        self.driver.command_executor._commands['executeCdpCommand'] = (
+            'POST', '/session/$sessionId/goog/cdp/execute')
+        return self.driver.execute('executeCdpCommand', {'cmd': cmd, 'params': params})['value']
+
+    def capture_region(self, region, beyond_viewport=False):
+        '''screenshots the page region (xmin, ymin, xmax, ymax) with Page.captureScreenshot'''
+        xmin, ymin, xmax, ymax = region
+        params = {
+            'format': self.screenshot_format,
+            'clip': {'x': xmin, 'y': ymin, 'width': xmax - xmin, 'height': ymax - ymin, 'scale': 1}
+        }
+        if beyond_viewport:
+            params['captureBeyondViewport'] = True
+        if self.screenshot_format == 'jpeg':
+            params['quality'] = 95
+        data = base64.b64decode(self.execute_cdp_cmd('Page.captureScreenshot', params)['data'])
+        im = Image.open(BytesIO(data))
+        if self.screenshot_format == 'jpeg':
+            # written as is by encode_image unless the image is modified
+            im.encoded_jpeg = data
+            return im
+        return im.convert('RGB')
+
+    def encode_image(self, im, **kwargs):
+        '''returns the jpeg bytes of im, captured jpeg bytes are used as they are'''
+        encoded = getattr(im, 'encoded_jpeg', None)
+        if encoded is not None:
+            return encoded
+        buf = BytesIO()
+        im.save(buf, format='JPEG', **kwargs)
+        return buf.getvalue()
+
+    def get_cell_boxes(self, id_count):
+        '''returns [len(text), text, box] of every cell id, read with a single script call'''
+        wait = WebDriverWait(self.driver, 10)
+        with_text = self.cell_box_type == 'both'
+        rects = json.loads(wait.until(lambda d: d.execute_script(CELL_BOXES_JS, id_count, with_text)))
+        return self.rects_to_contens(rects)
+
+    def rects_to_contens(self, rects):
+        '''converts [text, x, y, width, height] page rects to [len(text), text, box], a second rect after
+        them (the text span of both box types) becomes a second box'''
+        contens = []
+        for rect in rects:
+            txt = rect[0].strip()
+            item = [len(txt), txt]
+            for x, y, width, height in zip(*[iter(rect[1:])] * 4):
+                # same rounding as WebElement.location and WebElement.size
+                xmin = round(x)
+                ymin = round(y)
+                xmax = int(width + xmin)
+                ymax = int(height + ymin)
+                item.append([[xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax]])
+            contens.append(item)
+        return contens
+
+    def get_cell_boxes_by_element(self, id_count):
+        '''returns [len(text), text, box] of every cell id, querying the elements one by one'''
         # element = WebDriverWait(self.driver, 3).until(EC.presence_of_element_located((By.ID, '0')))
         contens = []
         for id in range(id_count):
@@ -244,23 +999,33 @@ class GenerateTable:
                 10).until(EC.presence_of_element_located((By.ID, str(id))))
             txt = e.text.strip()
             lentext = len(txt)
-            loc = e.location
-            size_ = e.size
-            xmin = loc['x']
-            ymin = loc['y']
-            xmax = int(size_['width'] + xmin)
-            ymax = int(size_['height'] + ymin)
+            item = [lentext, txt]
+            elements = [e]
+            if self.cell_box_type == 'both':
+                elements.append(self.driver.find_element(By.ID, f't{id}'))
+            for e in elements:
+                loc = e.location
+                size_ = e.size
+                xmin = loc['x']
+                ymin = loc['y']
+                xmax = int(size_['width'] + xmin)
+                ymax = int(size_['height'] + ymin)
+                item.append([[xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax]])
 
-            contens.append([
-                lentext, txt, [[xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax]]
-            ])
-
-        png = self.driver.get_screenshot_as_png()
-
-        im = Image.open(BytesIO(png)).convert('RGB')
-        im = im.crop((0, 0, max_width, max_height))
-        return im, contens
+            contens.append(item)
+        return contens
 
     def close(self):
+        if self.metrics is not None:
+            self.metrics.flush()
+        if self.shard_writer is not None:
+            self.shard_writer.close()
+            self.shard_writer = None
+        if self.render_client is not None:
+            self.render_client.close()
+            self.render_client = None
+        if self.driver is None:
+            return
         self.driver.stop_client()
         self.driver.quit()
+        self.driver = None
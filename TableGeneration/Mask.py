@@ -0,0 +1,90 @@
+import numpy as np
+
+
+def boxes_to_rects(boxes):
+    '''converts cell boxes of any nesting (..., 4, 2) to (N, 4) xmin, ymin, xmax, ymax'''
+    points = np.asarray(boxes).reshape(-1, 4, 2)
+    return np.concatenate([points.min(axis=1), points.max(axis=1)], axis=1).astype(np.int64)
+
+
+def draw_borders(rects, width, height, thickness=4):
+    '''Rasterizes the outlines of all rects (xmin, ymin, xmax, ymax) at once into a height x width uint8 mask
+    that is 255 on the outlines. An outline covers thickness // 2 pixels on both sides of the edge like
+    cv2.polylines, with square corners.
+
+    Every outline is its outer rect minus its inner rect, the corners of both go into one difference array
+    that two cumulative sums turn into coverage, so the cost is O(N + width * height) without a python loop
+    per rect.
+    '''
+    rects = np.asarray(rects, dtype=np.int64).reshape(-1, 4)
+    half = thickness // 2
+    diff = np.zeros((height + 1, width + 1), dtype=np.int32)
+    for offset, sign in ((-half, 1), (half + 1, -1)):
+        x0 = np.clip(rects[:, 0] + offset, 0, width)
+        y0 = np.clip(rects[:, 1] + offset, 0, height)
+        x1 = np.clip(rects[:, 2] - offset + 1, 0, width)
+        y1 = np.clip(rects[:, 3] - offset + 1, 0, height)
+        # inner rects of boxes thinner than the outline are empty
+        keep = (x0 < x1) & (y0 < y1)
+        x0, y0, x1, y1 = x0[keep], y0[keep], x1[keep], y1[keep]
+        np.add.at(diff, (y0, x0), sign)
+        np.add.at(diff, (y0, x1), -sign)
+        np.add.at(diff, (y1, x0), -sign)
+        np.add.at(diff, (y1, x1), sign)
+    coverage = diff.cumsum(axis=0).cumsum(axis=1)[:height, :width]
+    return np.where(coverage > 0, 255, 0).astype(np.uint8)
+
+
+def cell_border_mask(boxes, width, height, thickness=4):
+    '''the outline of every cell box and of the box around all of them'''
+    rects = boxes_to_rects(boxes)
+    table = [rects[:, 0].min(), rects[:, 1].min(), rects[:, 2].max(), rects[:, 3].max()]
+    return draw_borders(np.vstack([rects, table]), width, height, thickness)
+
+
+def cell_grid(structure):
+    '''returns (row, col, rowspan, colspan) of every cell of PP-Structure structure tokens, in cell order,
+    placing cells like html does: after the cells that span into their row'''
+    grid = []
+    occupied = set()
+    row = -1
+    col = 0
+    for i, token in enumerate(structure):
+        if token == '<tr>':
+            row += 1
+            col = 0
+        elif token in ('<td>', '<td'):
+            rowspan = colspan = 1
+            if token == '<td':
+                for attr in structure[i + 1:]:
+                    if attr == '>':
+                        break
+                    value = int(attr.split('"')[1])
+                    if 'rowspan' in attr:
+                        rowspan = value
+                    else:
+                        colspan = value
+            while (row, col) in occupied:
+                col += 1
+            grid.append((row, col, rowspan, colspan))
+            occupied.update((r, c) for r in range(row, row + rowspan) for c in range(col, col + colspan))
+            col += colspan
+    return np.array(grid, dtype=np.int64).reshape(-1, 4)
+
+
+def structure_maps(boxes, structure, width, height):
+    '''Returns the row, col and span maps of a table: every pixel of a cell box holds the first row (row map)
+    or column (col map) of the cell plus one as uint16, 0 outside of cells, and the span map is 255 in cells
+    that span several rows or columns'''
+    rects = boxes_to_rects(boxes)
+    grid = cell_grid(structure)
+    # the cell of every pixel, the maps are looked up from it at once
+    index_map = np.zeros((height, width), dtype=np.int32)
+    for i, (x0, y0, x1, y1) in enumerate(rects.tolist()):
+        index_map[max(y0, 0):max(y1 + 1, 0), max(x0, 0):max(x1 + 1, 0)] = i + 1
+    spans = (grid[:, 2] > 1) | (grid[:, 3] > 1)
+    return {
+        'row': np.concatenate([[0], grid[:, 0] + 1]).astype(np.uint16)[index_map],
+        'col': np.concatenate([[0], grid[:, 1] + 1]).astype(np.uint16)[index_map],
+        'span': np.concatenate([[0], np.where(spans, 255, 0)]).astype(np.uint8)[index_map]
+    }
@@ -0,0 +1,126 @@
+import glob
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+PREFIX = 'tablegen_'
+
+
+def format_key(name, labels):
+    if not labels:
+        return f'{PREFIX}{name}'
+    labels = ','.join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+    return f'{PREFIX}{name}{{{labels}}}'
+
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metrics:
+    '''Stage timers and counters of one process.
+
+    Every run of a stage adds to stage_seconds_total and stage_runs_total, counters are added with inc.
+    With keep_samples the duration of every run is kept as well for percentiles (see summary), which long
+    runs should not do. With path the metrics are written there in prometheus text format every
+    flush_interval seconds by a daemon thread, so the file stays current while the process is stuck in a
+    stage; aggregate_metrics sums the files of all processes of a run.
+    '''
+
+    def __init__(self, path=None, flush_interval=10, keep_samples=False):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.keep_samples = keep_samples
+        self.values = {}
+        self.times = {}
+        self.lock = threading.Lock()
+        # the flush thread and close both flush, they share the tmp file
+        self.flush_lock = threading.Lock()
+        if path is not None:
+            threading.Thread(target=self.flush_periodically, daemon=True).start()
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if self.keep_samples:
+                self.times.setdefault(stage, []).append(elapsed)
+            self.inc('stage_seconds_total', elapsed, stage=stage)
+            self.inc('stage_runs_total', 1, stage=stage)
+
+    def inc(self, name, value=1, **labels):
+        key = format_key(name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def to_prometheus(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        return ''.join(f'{key} {format_value(value)}\n' for key, value in values)
+
+    def flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        '''writes the metrics file atomically, so readers never see a partial file'''
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with self.flush_lock:
+            with open(tmp_path, 'w') as f:
+                f.write(self.to_prometheus())
+            os.replace(tmp_path, self.path)
+
+    def summary(self):
+        '''returns count, total seconds and p50/p95 milliseconds of every stage, needs keep_samples'''
+        summary = {}
+        for stage, times in self.times.items():
+            ms = np.array(times) * 1000
+            summary[stage] = {
+                'count': len(times),
+                'total_s': round(float(ms.sum()) / 1000, 4),
+                'p50_ms': round(float(np.percentile(ms, 50)), 3),
+                'p95_ms': round(float(np.percentile(ms, 95)), 3)
+            }
+        return summary
+
+
+def aggregate_metrics(metrics_dir):
+    '''sums the metrics files every process flushed into metrics_dir'''
+    values = {}
+    for path in glob.glob(os.path.join(metrics_dir, '*.prom')):
+        with open(path) as f:
+            for line in f:
+                key, _, value = line.rpartition(' ')
+                if key:
+                    values[key] = values.get(key, 0) + float(value)
+    return ''.join(f'{key} {format_value(value)}\n' for key, value in sorted(values.items()))
+
+
+def serve_metrics(metrics_dir, port):
+    '''serves the summed metrics of metrics_dir at http://localhost:port/metrics from a daemon thread'''
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = aggregate_metrics(metrics_dir).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,156 @@
+import multiprocessing as mp
+import queue
+import time
+from io import BytesIO
+from PIL import Image
+
+
+class Stalled(Exception):
+    '''no table finished for task_timeout seconds, or a process generating them died'''
+
+
+def pack_image(im):
+    '''images captured as jpeg travel between processes as their bytes instead of decoded pixels'''
+    encoded = getattr(im, 'encoded_jpeg', None)
+    return encoded if encoded is not None else im
+
+
+def unpack_image(im):
+    if isinstance(im, bytes):
+        data = im
+        im = Image.open(BytesIO(data))
+        im.encoded_jpeg = data
+    return im
+
+
+def produce(build, build_args, indices, table_queue):
+    '''creates the table, html and structure of every index'''
+    generator = build(*build_args)
+    for index in indices:
+        try:
+            generator.seed_index(index)
+            with generator.time_stage('table_create'):
+                table = generator.create_table()
+                sample = table.create()
+        except Exception as e:
+            generator.record_failure(e)
+            table = sample = None
+        table_queue.put((index, table, sample))
+    generator.close()
+
+
+def render(build, build_args, table_queue, image_queue):
+    '''renders created tables with one long-lived renderer until it receives None'''
+    generator = build(*build_args)
+    try:
+        while True:
+            item = table_queue.get()
+            if item is None:
+                break
+            index, table, sample = item
+            out = None
+            if sample is not None:
+                id_count, html_content, structure, border = sample
+                try:
+                    im, contens = generator.render_table(table, html_content, id_count)
+                    out = (pack_image(im), html_content, structure, contens, border)
+                except Exception as e:
+                    generator.record_failure(e)
+                finally:
+                    generator.recycle_browser()
+            image_queue.put((index, out))
+    finally:
+        generator.close()
+
+
+def encode(build, build_args, image_queue, done_queue, save_html):
+    '''clips, encodes and writes rendered tables until it receives None'''
+    generator = build(*build_args)
+    try:
+        while True:
+            item = image_queue.get()
+            if item is None:
+                break
+            index, out = item
+            ok = False
+            if out is not None:
+                try:
+                    generator.save_sample(index, (unpack_image(out[0]), ) + tuple(out[1:]), save_html=save_html)
+                    ok = True
+                except Exception as e:
+                    generator.record_failure(e)
+            done_queue.put((index, ok))
+    finally:
+        generator.close()
+
+
+def check_stages(producers, consumers):
+    '''raises Stalled when a stage process died, producers exit once their indices are created, the other
+    stages only when they are stopped'''
+    for p in producers + consumers:
+        if p.exitcode is not None and (p.exitcode != 0 or p in consumers):
+            raise Stalled(f'a pipeline stage process exited with {p.exitcode}')
+
+
+def run_pipeline(build,
+                 build_args,
+                 indices,
+                 num_producers=1,
+                 num_renderers=4,
+                 num_encoders=2,
+                 queue_size=64,
+                 save_html=True,
+                 task_timeout=0):
+    '''Generates tables in three independently sized stages connected by bounded queues: producers create
+    tables, renderers (one browser each) render them and encoders clip, encode and write them, so renderers
+    never wait on table creation or disk. build(*build_args) must return a GenerateTable.
+
+    yields (index, ok) of every index once it is written or failed. Raises Stalled when a stage process died
+    or no index finished for task_timeout seconds (0: no limit), the stages are terminated then
+    '''
+    indices = list(indices)
+    table_queue = mp.Queue(queue_size)
+    image_queue = mp.Queue(queue_size)
+    done_queue = mp.Queue()
+    producers = [
+        mp.Process(target=produce, args=(build, build_args, indices[i::num_producers], table_queue), daemon=True)
+        for i in range(num_producers)
+    ]
+    renderers = [
+        mp.Process(target=render, args=(build, build_args, table_queue, image_queue), daemon=True)
+        for _ in range(num_renderers)
+    ]
+    encoders = [
+        mp.Process(target=encode, args=(build, build_args, image_queue, done_queue, save_html), daemon=True)
+        for _ in range(num_encoders)
+    ]
+    for p in producers + renderers + encoders:
+        p.start()
+    try:
+        last_done = time.time()
+        for _ in range(len(indices)):
+            while True:
+                try:
+                    item = done_queue.get(timeout=1)
+                    break
+                except queue.Empty:
+                    check_stages(producers, renderers + encoders)
+                    if task_timeout and time.time() - last_done > task_timeout:
+                        raise Stalled(f'no table finished for {task_timeout}s')
+            last_done = time.time()
+            yield item
+        # every index is done, stop the stages in order
+        for p in producers:
+            p.join()
+        for _ in renderers:
+            table_queue.put(None)
+        for p in renderers:
+            p.join()
+        for _ in encoders:
+            image_queue.put(None)
+        for p in encoders:
+            p.join()
+    finally:
+        for p in producers + renderers + encoders:
+            if p.is_alive():
+                p.terminate()
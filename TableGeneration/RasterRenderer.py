@@ -0,0 +1,313 @@
+import re
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+# css px of <font size=1..3>
+FONT_SIZES = {1: 10, 2: 13, 3: 16}
+# margin of the html body
+BODY_MARGIN = 8
+BORDER_RE = re.compile(r'border(-top|-bottom|-left|-right)?\s*:\s*(\d+)px\s+(\w+)')
+BORDER_COLOR_RE = re.compile(r'border-color\s*:\s*([^;]*);')
+
+
+def parse_border(css):
+    '''parses the border declarations of create_border_style into {side: (width, line type, color)}'''
+    borders = {}
+    m = BORDER_RE.search(css or '')
+    if m is None:
+        return borders
+    side, width, line = m.groups()
+    color = BORDER_COLOR_RE.search(css)
+    color = color.group(1).strip() if color else 'black'
+    try:
+        color = ImageColor.getrgb(color)
+    except ValueError:
+        # the browser ignores invalid colors and falls back to black as well
+        color = (0, 0, 0)
+    sides = [side[1:]] if side else ['top', 'bottom', 'left', 'right']
+    for s in sides:
+        borders[s] = (int(width), line, color)
+    return borders
+
+
+class RasterRenderer:
+    '''Lays out a created Table without a browser and draws it with PIL.
+
+    Follows the auto table layout of the browser closely enough for training data: column widths come from
+    text metrics or the css cell width, spans from the placed cells, collapsed borders from create_border_style.
+    render returns the same (image, contens) as GenerateTable.html_to_img.
+    '''
+
+    def __init__(self,
+                 cell_box_type='cell',
+                 browser_width=1920,
+                 browser_height=1920,
+                 font_path=None,
+                 bold_font_path=None,
+                 max_page_width=0,
+                 max_page_height=0):
+        self.cell_box_type = cell_box_type
+        self.browser_width = browser_width
+        self.browser_height = browser_height
+        # tables are laid out browser_width wide like in the browser, pages larger than this cap are dropped
+        self.max_page_width = max_page_width or browser_width
+        self.max_page_height = max_page_height or browser_height
+        self.font_path = font_path
+        self.bold_font_path = bold_font_path
+        self.fonts = {}
+        # bold fonts that are drawn twice with an offset because no bold font file was found
+        self.synthetic_bold = set()
+        self.text_widths = {}
+
+    def get_font(self, size, bold=False):
+        key = (size, bold)
+        if key not in self.fonts:
+            if bold:
+                candidates = [self.bold_font_path, 'DejaVuSans-Bold.ttf']
+            else:
+                candidates = [self.font_path, 'DejaVuSans.ttf']
+            for candidate in candidates:
+                if candidate is None:
+                    continue
+                try:
+                    self.fonts[key] = ImageFont.truetype(candidate, size)
+                    break
+                except OSError:
+                    continue
+            else:
+                if bold:
+                    self.fonts[key] = self.get_font(size)
+                    self.synthetic_bold.add(key)
+                else:
+                    try:
+                        self.fonts[key] = ImageFont.load_default(size)
+                    except TypeError:
+                        # Pillow before 10.1 only has the unsized bitmap font
+                        self.fonts[key] = ImageFont.load_default()
+        return self.fonts[key]
+
+    def text_width(self, font, text):
+        key = (id(font), text)
+        width = self.text_widths.get(key)
+        if width is None:
+            width = self.text_widths[key] = font.getlength(text)
+        return width
+
+    def wrap(self, font, text, width):
+        '''breaks text into lines no wider than width, breaking inside words when needed (word-break: break-word)'''
+        lines = []
+        line = ''
+        for word in text.split():
+            candidate = f'{line} {word}' if line else word
+            if self.text_width(font, candidate) <= width:
+                line = candidate
+                continue
+            if line:
+                lines.append(line)
+            line = ''
+            for ch in word:
+                if line and self.text_width(font, line + ch) > width:
+                    lines.append(line)
+                    line = ''
+                line += ch
+        if line:
+            lines.append(line)
+        return lines
+
+    def render(self, table):
+        '''returns the image of table and [len(text), text, box] of every cell id'''
+        size = FONT_SIZES.get(table.font_size, 16)
+        self.text_widths = {}
+        layouts = {True: table.th_layout, False: table.td_layout}
+        table_border = parse_border(table.border_style.get('table') if table.border_style else '')
+        cell_borders = {
+            True: parse_border(table.border_style.get('th') if table.border_style else ''),
+            False: parse_border(table.border_style.get('td') if table.border_style else '')
+        }
+        n_rows, n_cols = table.no_of_rows, table.no_of_cols
+
+        # collapsed border widths of every grid line, the widest border touching a line wins
+        h_lines = np.zeros(n_rows + 1)
+        v_lines = np.zeros(n_cols + 1)
+        for cell in table.cells:
+            borders = cell_borders[cell['header']]
+            r0, c0 = cell['row'], cell['col']
+            r1, c1 = r0 + cell['rowspan'], c0 + cell['colspan']
+            for side, idx, lines in (('top', r0, h_lines), ('bottom', r1, h_lines), ('left', c0, v_lines),
+                                     ('right', c1, v_lines)):
+                if side in borders:
+                    lines[idx] = max(lines[idx], borders[side][0])
+        for side, idx, lines in (('top', 0, h_lines), ('bottom', -1, h_lines), ('left', 0, v_lines), ('right', -1,
+                                                                                                          v_lines)):
+            if side in table_border:
+                lines[idx] = max(lines[idx], table_border[side][0])
+
+        # column widths: css width when set, otherwise the unwrapped text width
+        items = []
+        for cell in table.cells:
+            bold = cell['header'] or cell['effect'] == table.bold
+            font = self.get_font(size, bold)
+            if bold and (size, True) in self.synthetic_bold:
+                cell = dict(cell, synthetic_bold=True)
+            layout = layouts[cell['header']]
+            pad_top, pad_bot, pad_left, pad_right = layout['padding']
+            text = ' '.join(cell['text'].split())
+            if layout['width']:
+                want = layout['width']
+            else:
+                want = np.ceil(self.text_width(font, text))
+            items.append((cell, font, layout, text, want + pad_left + pad_right))
+        col_w = np.zeros(n_cols)
+        for cell, font, layout, text, want in items:
+            if cell['colspan'] == 1:
+                col_w[cell['col']] = max(col_w[cell['col']], want)
+        for cell, font, layout, text, want in items:
+            c0, c1 = cell['col'], cell['col'] + cell['colspan']
+            if cell['colspan'] > 1 and col_w[c0:c1].sum() < want:
+                col_w[c0:c1] += (want - col_w[c0:c1].sum()) / cell['colspan']
+        # shrink to the window like the browser does, wrapping text inside the narrower columns
+        available = self.browser_width - 2 * BODY_MARGIN - v_lines.sum()
+        if col_w.sum() > available > 0:
+            min_w = np.full(n_cols, float(size))
+            extra = np.maximum(col_w - min_w, 0)
+            scale = max(available - min_w.sum(), 0) / max(extra.sum(), 1)
+            col_w = min_w + extra * min(scale, 1)
+            # rounding must not widen the page past the window, the pixels flooring drops go to the widest columns
+            fitted = np.floor(col_w)
+            leftover = int(max(np.floor(available) - fitted.sum(), 0))
+            fitted[np.argsort(-col_w, kind='stable')[:leftover]] += 1
+            col_w = fitted
+        col_w = np.round(col_w)
+
+        # row heights from the wrapped text
+        ascent, descent = self.get_font(size).getmetrics()
+        line_h = ascent + descent
+        wrapped = []
+        row_h = np.zeros(n_rows)
+        for cell, font, layout, text, want in items:
+            pad_top, pad_bot, pad_left, pad_right = layout['padding']
+            c0, c1 = cell['col'], cell['col'] + cell['colspan']
+            content_w = col_w[c0:c1].sum() + v_lines[c0 + 1:c1].sum() - pad_left - pad_right
+            lines = self.wrap(font, text, max(content_w, 1))
+            if not lines and self.cell_box_type in ('text', 'both'):
+                # the text span still holds its trailing space
+                lines = ['']
+            need = max(len(lines) * line_h, layout['height']) + pad_top + pad_bot
+            wrapped.append(lines)
+            if cell['rowspan'] == 1:
+                row_h[cell['row']] = max(row_h[cell['row']], need)
+        for (cell, font, layout, text, want), lines in zip(items, wrapped):
+            r0, r1 = cell['row'], cell['row'] + cell['rowspan']
+            need = max(len(lines) * line_h, layout['height']) + sum(layout['padding'][:2])
+            if cell['rowspan'] > 1 and row_h[r0:r1].sum() + h_lines[r0 + 1:r1].sum() < need:
+                row_h[r1 - 1] += need - row_h[r0:r1].sum() - h_lines[r0 + 1:r1].sum()
+
+        # grid line centres, a cell box runs from the centre of one line to the centre of the next
+        xs = BODY_MARGIN + v_lines[0] / 2 + np.concatenate([[0], np.cumsum(col_w + v_lines[1:] / 2 + v_lines[:-1] / 2)])
+        ys = BODY_MARGIN + h_lines[0] / 2 + np.concatenate([[0], np.cumsum(row_h + h_lines[1:] / 2 + h_lines[:-1] / 2)])
+        # the canvas holds the whole laid out table, like the page fit_window sizes the window to
+        width = max(int(np.ceil(xs[-1] + v_lines[-1] / 2 + BODY_MARGIN)), 1)
+        height = max(int(np.ceil(ys[-1] + h_lines[-1] / 2 + BODY_MARGIN)), 1)
+        if width > self.max_page_width or height > self.max_page_height:
+            from TableGeneration.GenerateTable import TableTooLarge
+            raise TableTooLarge(f'page of {width}x{height} exceeds {self.max_page_width}x{self.max_page_height}')
+        im = Image.new('RGB', (width, height), 'white')
+        draw = ImageDraw.Draw(im)
+
+        contens = []
+        for (cell, font, layout, text, want), lines in zip(items, wrapped):
+            r0, c0 = cell['row'], cell['col']
+            r1, c1 = r0 + cell['rowspan'], c0 + cell['colspan']
+            x0, x1, y0, y1 = xs[c0], xs[c1], ys[r0], ys[r1]
+            if cell['color'] is not None:
+                draw.rectangle([x0, y0, x1, y1], fill=tuple(cell['color']))
+            pad_top, pad_bot, pad_left, pad_right = layout['padding']
+            left = x0 + v_lines[c0] / 2 + pad_left
+            right = x1 - v_lines[c1] / 2 - pad_right
+            top = y0 + h_lines[r0] / 2 + pad_top
+            bottom = y1 - h_lines[r1] / 2 - pad_bot
+            block_h = len(lines) * line_h
+            if layout['vertical_align'] == 'top':
+                ty = top
+            elif layout['vertical_align'] == 'bottom':
+                ty = bottom - block_h
+            else:
+                # 'center' is not a css vertical-align value, so the cell keeps the default middle
+                ty = (top + bottom - block_h) / 2
+            align = 'center' if cell['header'] else table.text_align
+            text_box = [right, ty, left, ty + block_h]
+            for i, line in enumerate(lines):
+                line_w = self.text_width(font, line)
+                if align == 'left':
+                    tx = left
+                elif align == 'right':
+                    tx = right - line_w
+                else:
+                    tx = (left + right - line_w) / 2
+                ly = ty + i * line_h
+                draw.text((tx, ly), line, font=font, fill='black')
+                if cell.get('synthetic_bold'):
+                    draw.text((tx + 1, ly), line, font=font, fill='black')
+                if cell['effect'] == table.underline:
+                    draw.line([tx, ly + ascent + 1, tx + line_w, ly + ascent + 1], fill='black')
+                text_box = [min(text_box[0], tx), text_box[1], max(text_box[2], tx + line_w), text_box[3]]
+
+            boxes = []
+            if self.cell_box_type in ('cell', 'both'):
+                xmin, ymin, xmax, ymax = round(x0), round(y0), int(x1 - x0 + round(x0)), int(y1 - y0 + round(y0))
+                boxes.append([[xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax]])
+            if self.cell_box_type in ('text', 'both'):
+                xmin, ymin = round(text_box[0]), round(text_box[1])
+                xmax, ymax = int(max(text_box[2] - text_box[0], 0) + xmin), int(text_box[3] - text_box[1] + ymin)
+                boxes.append([[xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax]])
+            contens.append([len(text), text] + boxes)
+
+        self.draw_borders(draw, table, cell_borders, table_border, xs, ys)
+        self.check_boxes(contens, width, height)
+        return im, contens
+
+    def check_boxes(self, contens, width, height):
+        '''raises when a box of the label is not inside the width x height image, so no label points past it'''
+        for conten in contens:
+            for box in conten[2:]:
+                if not all(0 <= x <= width and 0 <= y <= height for x, y in box):
+                    raise ValueError(f'box {box} of cell {conten[1]!r} is outside the {width}x{height} image')
+
+    def draw_borders(self, draw, table, cell_borders, table_border, xs, ys):
+        for cell in table.cells:
+            r0, c0 = cell['row'], cell['col']
+            r1, c1 = r0 + cell['rowspan'], c0 + cell['colspan']
+            for side, border in cell_borders[cell['header']].items():
+                self.draw_side(draw, side, border, xs[c0], xs[c1], ys[r0], ys[r1])
+        for side, border in table_border.items():
+            self.draw_side(draw, side, border, xs[0], xs[-1], ys[0], ys[-1])
+
+    def draw_side(self, draw, side, border, x0, x1, y0, y1):
+        width, line, color = border
+        if side == 'top':
+            segment = [x0, y0, x1, y0]
+        elif side == 'bottom':
+            segment = [x0, y1, x1, y1]
+        elif side == 'left':
+            segment = [x0, y0, x0, y1]
+        else:
+            segment = [x1, y0, x1, y1]
+        if line == 'double' and width >= 3:
+            # two lines of a third of the width, one on each edge of the border
+            offset = width / 3
+            dx, dy = (0, offset) if side in ('top', 'bottom') else (offset, 0)
+            for sign in (-1, 1):
+                draw.line([segment[0] + sign * dx, segment[1] + sign * dy, segment[2] + sign * dx,
+                           segment[3] + sign * dy], fill=color, width=max(int(offset), 1))
+        elif line in ('dashed', 'dotted'):
+            dash = width * 3 if line == 'dashed' else width
+            length = max(abs(segment[2] - segment[0]), abs(segment[3] - segment[1]))
+            for start in np.arange(0, length, dash * 2):
+                end = min(start + dash, length)
+                if side in ('top', 'bottom'):
+                    part = [segment[0] + start, segment[1], segment[0] + end, segment[3]]
+                else:
+                    part = [segment[0], segment[1] + start, segment[2], segment[1] + end]
+                draw.line(part, fill=color, width=width)
+        else:
+            draw.line(segment, fill=color, width=width)
@@ -0,0 +1,322 @@
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from collections import deque
+from multiprocessing.connection import Client, Listener
+from TableGeneration.Pipeline import pack_image, unpack_image
+
+
+class RemoteRenderError(Exception):
+    '''the render server could not render a table, the message is the exception type it failed with'''
+
+
+def parse_address(address):
+    '''host:port is a localhost tcp address, anything else the path of a unix socket'''
+    if not address.startswith('/') and ':' in address:
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    return address
+
+
+def render_batch(generator, batch):
+    '''renders a batch of (client_id, request_id, html_content, id_count, cell_box_type) requests sharing one
+    cell_box_type, several tables are tiled on one page with one screenshot. Returns (client_id, request_id,
+    image, contens, error) of every request'''
+    generator.cell_box_type = batch[0][4]
+    outs = [None] * len(batch)
+    errors = [None] * len(batch)
+    try:
+        if len(batch) > 1:
+            outs = generator.run_with_watchdog(generator.html_to_tiles, [(r[3], r[2]) for r in batch])
+        else:
+            outs = [generator.run_with_watchdog(generator.html_to_img, batch[0][2], batch[0][3])]
+    except Exception as e:
+        generator.record_failure(e)
+        errors = [generator.last_error] * len(batch)
+    finally:
+        generator.recycle_browser(len(batch))
+    results = []
+    for (client_id, request_id, *_), out, error in zip(batch, outs, errors):
+        if isinstance(out, Exception):
+            # a table html_to_tiles rendered on a page of its own failed alone
+            results.append((client_id, request_id, None, None, type(out).__name__))
+        elif out is None:
+            results.append((client_id, request_id, None, None, error or 'TileError'))
+        else:
+            results.append((client_id, request_id, pack_image(out[0]), out[1], None))
+    return results
+
+
+def render_batches(build, build_args, worker_id, task_queue, result_queue):
+    '''renders (batch_no, batch) tasks with one long-lived browser until it receives None, the results go to
+    result_queue as (worker_id, batch_no, results)'''
+    generator = build(*build_args)
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            batch_no, batch = task
+            result_queue.put((worker_id, batch_no, render_batch(generator, batch)))
+    finally:
+        generator.close()
+
+
+class RenderServer:
+    '''Renders the tables of any number of clients with a fixed pool of browsers.
+
+    Every one of num_browsers processes keeps one generator (build(*build_args)) and its browser. Clients
+    (RenderClient) send the html and id_count of Table.create and receive the image and cell boxes, so the
+    browsers on a host do not grow with the number of generating jobs. Requests wait in one queue per client and
+    are dispatched round robin between clients whenever a browser is idle, up to max_batch requests of the same
+    cell_box_type are tiled on one page. A client with max_pending requests waiting is not read from until they
+    are dispatched, which blocks its sends. A browser process that dies (it failed to start or crashed) is
+    replaced, the requests it was rendering are answered with a RemoteRenderError.
+    '''
+
+    def __init__(self, address, build, build_args, num_browsers=4, max_batch=1, max_pending=64, authkey=None):
+        self.address = parse_address(address)
+        self.build = build
+        self.build_args = build_args
+        self.num_browsers = num_browsers
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.authkey = authkey
+        self.pending = {}  # client_id: deque of requests
+        self.outboxes = {}  # client_id: queue.Queue of results, sent by the thread of the client
+        self.condition = threading.Condition()
+        self.result_queue = mp.Queue()
+        # worker_id: process, its own task queue and the (batch_no, batch) it renders or None when idle
+        self.workers = {}
+        self.task_queues = {}
+        self.in_flight = {}
+        self.batch_numbers = itertools.count()
+        self.stopping = False
+
+    def serve_forever(self):
+        # a terminated server still stops its browsers and removes its socket
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            self.remove_stale_socket()
+        with self.condition:
+            for worker_id in range(self.num_browsers):
+                self.start_worker(worker_id)
+        threading.Thread(target=self.dispatch, daemon=True).start()
+        threading.Thread(target=self.collect, daemon=True).start()
+        threading.Thread(target=self.monitor, daemon=True).start()
+        listener = Listener(self.address, authkey=self.authkey)
+        print(f'rendering for clients at {self.address} with {self.num_browsers} browsers')
+        try:
+            for client_id in itertools.count():
+                conn = listener.accept()
+                outbox = queue.Queue()
+                with self.condition:
+                    self.pending[client_id] = deque()
+                    self.outboxes[client_id] = outbox
+                threading.Thread(target=self.receive, args=(client_id, conn), daemon=True).start()
+                threading.Thread(target=self.send, args=(conn, outbox), daemon=True).start()
+        finally:
+            listener.close()
+            with self.condition:
+                self.stopping = True
+                workers = list(self.workers.values())
+                for task_queue in self.task_queues.values():
+                    task_queue.put(None)
+            for p in workers:
+                p.join(30)
+                if p.is_alive():
+                    p.terminate()
+
+    def start_worker(self, worker_id):
+        '''starts (or replaces) the browser process worker_id, called holding the condition'''
+        # a fresh queue, a killed worker may have died holding the lock of its old one
+        self.task_queues[worker_id] = mp.Queue()
+        self.in_flight[worker_id] = None
+        self.workers[worker_id] = mp.Process(target=render_batches,
+                                             args=(self.build, self.build_args, worker_id,
+                                                   self.task_queues[worker_id], self.result_queue),
+                                             daemon=True)
+        self.workers[worker_id].start()
+        self.condition.notify_all()
+
+    def monitor(self, interval=1):
+        '''replaces dead browser processes and fails the requests they were rendering'''
+        while True:
+            time.sleep(interval)
+            with self.condition:
+                if self.stopping:
+                    return
+                for worker_id, p in list(self.workers.items()):
+                    if p.is_alive():
+                        continue
+                    print(f'render worker {worker_id} exited with {p.exitcode}, restarting it')
+                    task = self.in_flight[worker_id]
+                    if task is not None:
+                        self.reply([(client_id, request_id, None, None, 'WorkerDied')
+                                    for client_id, request_id, *_ in task[1]])
+                    self.start_worker(worker_id)
+
+    def reply(self, results):
+        '''hands (client_id, request_id, image, contens, error) results to the senders of connected clients,
+        called holding the condition'''
+        for client_id, *result in results:
+            outbox = self.outboxes.get(client_id)
+            if outbox is not None:
+                outbox.put(tuple(result))
+
+    def remove_stale_socket(self):
+        '''removes the socket file of a server that is gone, a running one is left alone'''
+        try:
+            Client(self.address, authkey=self.authkey).close()
+        except ConnectionRefusedError:
+            os.remove(self.address)
+            return
+        raise OSError(f'a render server is already serving {self.address}')
+
+    def receive(self, client_id, conn):
+        '''queues the requests of a client until it disconnects'''
+        try:
+            while True:
+                request_id, html_content, id_count, cell_box_type = conn.recv()
+                with self.condition:
+                    pending = self.pending[client_id]
+                    self.condition.wait_for(lambda: len(pending) < self.max_pending)
+                    pending.append((client_id, request_id, html_content, id_count, cell_box_type))
+                    self.condition.notify_all()
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self.condition:
+                # requests already rendering are dropped by collect
+                del self.pending[client_id]
+                outbox = self.outboxes.pop(client_id)
+            outbox.put(None)
+
+    def send(self, conn, outbox):
+        '''sends the results of a client from its own thread, so a slow client only stalls itself'''
+        try:
+            while True:
+                result = outbox.get()
+                if result is None:
+                    break
+                conn.send(result)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def next_batch(self):
+        '''takes up to max_batch requests round robin between the clients, all with the cell_box_type of the
+        first one'''
+        batch = []
+        clients = [pending for pending in self.pending.values() if pending]
+        # the next batch starts with the next client
+        first = next(iter(self.pending))
+        self.pending[first] = self.pending.pop(first)
+        cell_box_type = clients[0][0][4]
+        while clients and len(batch) < self.max_batch:
+            for pending in list(clients):
+                if len(batch) == self.max_batch:
+                    break
+                if not pending or pending[0][4] != cell_box_type:
+                    clients.remove(pending)
+                    continue
+                batch.append(pending.popleft())
+        return batch
+
+    def idle_workers(self):
+        return [worker_id for worker_id, task in self.in_flight.items() if task is None]
+
+    def dispatch(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.idle_workers() and any(self.pending.values()))
+                worker_id = self.idle_workers()[0]
+                task = next(self.batch_numbers), self.next_batch()
+                self.in_flight[worker_id] = task
+                self.task_queues[worker_id].put(task)
+                self.condition.notify_all()
+
+    def collect(self):
+        while True:
+            worker_id, batch_no, results = self.result_queue.get()
+            with self.condition:
+                task = self.in_flight.get(worker_id)
+                # results of a batch monitor already failed are dropped, every request gets one reply
+                if task is None or task[0] != batch_no:
+                    continue
+                self.in_flight[worker_id] = None
+                self.reply(results)
+                self.condition.notify_all()
+
+
+class RenderClient:
+    '''renders tables with a RenderServer instead of a browser of its own. A server that cannot be reached, does
+    not answer within timeout seconds or closes the connection raises RemoteRenderError, the next render connects
+    again'''
+
+    def __init__(self, address, authkey=None, timeout=600):
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self.timeout = timeout
+        self.conn = None
+        self.request_ids = itertools.count()
+
+    def connect(self):
+        if self.conn is None:
+            try:
+                self.conn = Client(self.address, authkey=self.authkey)
+            except OSError as e:
+                raise RemoteRenderError(f'cannot reach the render server: {e!r}') from e
+        return self.conn
+
+    def render(self, html_content, id_count, cell_box_type='cell'):
+        '''returns the image and [len(text), text, box(, box)] of every cell, like GenerateTable.html_to_img'''
+        result = self.render_many([(html_content, id_count)], cell_box_type)[0]
+        if isinstance(result, RemoteRenderError):
+            raise result
+        return result
+
+    def render_many(self, samples, cell_box_type='cell', depth=8):
+        '''renders (html_content, id_count) samples with up to depth requests in flight, returns (im, contens)
+        or the RemoteRenderError of every sample in order'''
+        results = {}
+        request_ids = []
+        samples = iter(samples)
+        in_flight = 0
+        conn = self.connect()
+        while True:
+            try:
+                for html_content, id_count in itertools.islice(samples, depth - in_flight):
+                    request_id = next(self.request_ids)
+                    conn.send((request_id, html_content, id_count, cell_box_type))
+                    request_ids.append(request_id)
+                    in_flight += 1
+                if in_flight == 0:
+                    break
+                if not conn.poll(self.timeout):
+                    raise RemoteRenderError(f'no reply from the render server within {self.timeout}s')
+                request_id, im, contens, error = conn.recv()
+            except (EOFError, OSError) as e:
+                self.close()
+                raise RemoteRenderError(f'lost the render server: {e!r}') from e
+            except RemoteRenderError:
+                # late replies would be taken for those of the next requests
+                self.close()
+                raise
+            in_flight -= 1
+            if error is not None:
+                results[request_id] = RemoteRenderError(error)
+            else:
+                results[request_id] = unpack_image(im), contens
+        return [results[request_id] for request_id in request_ids]
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,91 @@
+import io
+import json
+import os
+import tarfile
+
+
+class ShardWriter:
+    '''Streams samples into size bounded tar shards instead of three small files per sample.
+
+    Every shard <prefix>_<n>.tar holds a <name>.<img_ext> and <name>.json member per sample and is accompanied by
+    <prefix>_<n>.jsonl with one compact label per line. manifest_<prefix>.jsonl records the shard and byte
+    offsets of every member, so a reader can seek or read the shards sequentially without listing them.
+    Extra members of a sample, like its targets, are stored as <name>.<key> and listed under 'extra' in the
+    manifest as [offset, size] by key. Writers of different processes must use different prefixes.
+    '''
+
+    def __init__(self, output, prefix, max_shard_size=1024, img_ext='jpg'):
+        self.output = output
+        self.prefix = prefix
+        self.img_ext = img_ext
+        self.max_shard_size = max_shard_size * 1024 * 1024  # MB
+        self.shard_index = -1
+        self.tar = None
+        self.label_file = None
+        os.makedirs(self.output, exist_ok=True)
+        self.manifest = open(os.path.join(self.output, f'manifest_{prefix}.jsonl'), 'a', encoding='utf-8')
+
+    @property
+    def shard_name(self):
+        return f'{self.prefix}_{self.shard_index:05d}'
+
+    def next_shard(self):
+        self.close_shard()
+        self.shard_index += 1
+        while os.path.exists(os.path.join(self.output, f'{self.shard_name}.tar')):
+            # never overwrite the shards of an earlier run with the same prefix
+            self.shard_index += 1
+        self.tar = tarfile.open(os.path.join(self.output, f'{self.shard_name}.tar'), 'w')
+        self.label_file = open(os.path.join(self.output, f'{self.shard_name}.jsonl'), 'w', encoding='utf-8')
+
+    def add_member(self, name, data):
+        '''adds a member and returns the offset of its data in the tar'''
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        self.tar.addfile(info, io.BytesIO(data))
+        blocks = (info.size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE
+        return self.tar.offset - blocks * tarfile.BLOCKSIZE
+
+    def write(self, name, img_bytes, label_info, extra=None):
+        '''adds one sample, label_info['filename'] should point to the image member <name>.<img_ext>.
+        extra maps member name suffixes to the bytes of further members of the sample'''
+        if self.tar is None or self.tar.offset >= self.max_shard_size:
+            self.next_shard()
+        label = json.dumps(label_info, ensure_ascii=False, separators=(',', ':'))
+        label_bytes = label.encode('utf-8')
+        img_offset = self.add_member(f'{name}.{self.img_ext}', img_bytes)
+        label_offset = self.add_member(f'{name}.json', label_bytes)
+        entry = {
+            'name': name,
+            'shard': f'{self.shard_name}.tar',
+            'img_offset': img_offset,
+            'img_size': len(img_bytes),
+            'label_offset': label_offset,
+            'label_size': len(label_bytes)
+        }
+        written = len(img_bytes) + len(label_bytes)
+        if extra:
+            entry['extra'] = {key: [self.add_member(f'{name}.{key}', data), len(data)] for key, data in extra.items()}
+            written += sum(len(data) for data in extra.values())
+        self.label_file.write(label + '\n')
+        # a sample is only listed in the manifest once its members are out of the tar buffer
+        self.tar.fileobj.flush()
+        self.manifest.write(json.dumps(entry) + '\n')
+        # a killed worker keeps every sample it wrote listed, resume reads the manifests
+        self.label_file.flush()
+        self.manifest.flush()
+        return written
+
+    def close_shard(self):
+        if self.tar is None:
+            return
+        self.tar.close()
+        self.label_file.close()
+        self.tar = None
+        self.label_file = None
+        self.manifest.flush()
+
+    def close(self):
+        self.close_shard()
+        if not self.manifest.closed:
+            self.manifest.close()
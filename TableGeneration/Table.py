@@ -1,8 +1,10 @@
 import random
 import numpy as np
 import math
+from functools import lru_cache
 from typing import Optional, Tuple, List
-from .utils_html import gray_color_name, blue_color_name
+from .utils_html import gray_color_name
+from .Corpus import Corpus, sample_numbers
 
 
 def color_to_hex_html(color):
@@ -16,13 +18,36 @@ def color_to_hex_html(color):
     return f"#{r_hex}{g_hex}{b_hex}"
 
 
-def load_courp(p, join_c=' '):
-    courp = []
-    with open(p, mode='r', encoding='utf-8') as f:
-        for line in f.readlines():
-            line = line.strip("\n").strip("\r\n")
-            courp.append(line)
-    return join_c.join(courp)
+@lru_cache(maxsize=None)
+def cell_templates(cell_box_type, effect_classes):
+    '''precompiles the html of a cell for every (header, effect, spans rows, colored) combination, only id,
+    color, span value and text are filled in per cell. Returns the templates in cell_template_index order'''
+    cell_id = ' id={id}' if cell_box_type in ('cell', 'both') else ''
+    if cell_box_type == 'text':
+        content = '<span id={id}>{text} </span>'
+    elif cell_box_type == 'both':
+        # the text box of cell id n is read from span id tn
+        content = '<span id=t{id}>{text} </span>'
+    else:
+        content = '{text}'
+    color_style = ' style="background-color: rgba({color[0]}, {color[1]}, {color[2]},1);"'
+    templates = {}
+    for header in (False, True):
+        tag = 'th' if header else 'td'
+        for effect, effect_class in enumerate(('', ) + effect_classes):
+            for by_row in (False, True):
+                span = 'rowspan' if by_row else 'colspan'
+                for colored in (False, True):
+                    templates[header, effect, by_row, colored] = (
+                        f'<{tag}{cell_id}{color_style if colored else ""} class="{effect_class}" {span}="{{span}}">'
+                        f'{content}</{tag}>')
+    return [templates[key] for key in sorted(templates)]
+
+
+def cell_template_index(headers, effects, by_row, colored):
+    '''index of the cell_templates entry of every cell'''
+    return headers.astype(int) * 16 + effects * 4 + by_row.astype(int) * 2 + colored.astype(int)
+
 
 class Table:
     def __init__(self,
@@ -39,10 +64,11 @@ class Table:
                  color_prob=0,
                  cell_max_width=0,
                  cell_max_height=0,
-                 border_type='full_line'):
+                 border_type='full_line',
+                 word_boundary=False):
         assert cell_box_type in [
-            'cell', 'text'
-        ], "cell_box_type must in ['cell', 'text'],cell: use cell location as cell box; text: use location of text in cell as cell box"
+            'cell', 'text', 'both'
+        ], "cell_box_type must in ['cell', 'text', 'both'],cell: use cell location as cell box; text: use location of text in cell as cell box; both: cell and text box"
         self.cell_box_type = cell_box_type
         self.no_of_rows = no_of_rows
         self.no_of_cols = no_of_cols
@@ -54,9 +80,11 @@ class Table:
         self.max_span_row_count = max_span_row_count
         self.max_span_col_count = max_span_col_count
         self.max_span_value = max_span_value
+        self.word_boundary = word_boundary  # english and chinese texts start and end at word boundaries
 
-        self.ch = load_courp(ch_dict_path, ' ')
-        self.en = load_courp(en_dict_path, ' ')
+        # a path or an already loaded Corpus, corpora are shared by all tables instead of read per table
+        self.ch_corpus = ch_dict_path if isinstance(ch_dict_path, Corpus) else Corpus.get(ch_dict_path)
+        self.en_corpus = en_dict_path if isinstance(en_dict_path, Corpus) else Corpus.get(en_dict_path)
 
         self.border_type = border_type
         self.spanflag = False
@@ -67,19 +95,26 @@ class Table:
             t: ''
             m: money
         '''
-        self.cell_types = np.chararray(shape=(self.no_of_rows,
-                                              self.no_of_cols))
-        '''headers matrix have two possible values: 's' and 'h' where 'h' means header and 's' means simple text'''
-        self.headers = np.chararray(shape=(self.no_of_rows, self.no_of_cols))
+        self.cell_types = np.full((self.no_of_rows, self.no_of_cols), 'e', dtype='<U1')
+        '''header_mask is True for header cells and False for simple text'''
+        self.header_mask = np.zeros((self.no_of_rows, self.no_of_cols), dtype=bool)
         '''A positive value at a position in matrix shows the number of columns to span and -1 will show to skip that cell as part of spanned cols'''
         self.col_spans_matrix = np.zeros(shape=(self.no_of_rows,
                                                 self.no_of_cols))
         '''A positive value at a position means number of rows to span and -1 will show to skip that cell as part of spanned rows'''
         self.row_spans_matrix = np.zeros(shape=(self.no_of_rows,
                                                 self.no_of_cols))
-        '''missing_cells will contain a list of (row,column) pairs where each pair would show a cell where no text should be written'''
-        self.missing_cells = []
+        '''missing_mask is True for cells where no text should be written'''
+        self.missing_mask = np.zeros((self.no_of_rows, self.no_of_cols), dtype=bool)
+
+
+    @property
+    def ch(self):
+        return self.ch_corpus.text
 
+    @property
+    def en(self):
+        return self.en_corpus.text
 
     def get_log_value(self):
         ''' returns log base 2 (x)'''
@@ -97,12 +132,9 @@ class Table:
         prob_numbers = 0.4
         prob_ens = 0.4
         prob_money = 0.2
-        for i, type in enumerate(
-                random.choices(
-                    ['n', 'm', 'e'],
-                    weights=[prob_numbers, prob_money, prob_ens],
-                    k=self.no_of_cols)):
-            self.cell_types[:, i] = type
+        self.cell_types[:] = random.choices(['n', 'm', 'e'],
+                                            weights=[prob_numbers, prob_money, prob_ens],
+                                            k=self.no_of_cols)
         '''The headers should be of type word'''
         self.cell_types[0:2, :] = 'e'
         
@@ -116,51 +148,12 @@ class Table:
             num_row_header = random.randint(1, 2)
 
         '''All cells should have simple text but the headers'''
-        self.headers[:] = 's' # simple text
-        self.headers[0:num_row_header, :] = 'h' # header
+        self.header_mask[:] = False # simple text
+        self.header_mask[0:num_row_header, :] = True # header
 
         # header_count will keep track of how many top rows and how many left columns are being considered as headers
         self.header_count = {'r': num_row_header, 'c': 0}
 
-    def generate_random_text(self, type):
-        '''cell_types matrix have two possible values:
-            c: chinese
-            e: english
-            n: number
-            t: ''
-            m: money
-
-        '''
-        if type in ['n', 'm']:
-            max_num = random.choice([10, 100, 1000, 10000])
-            if random.random() < 0.5:
-                out = '{:.2f}'.format(random.random() * max_num)
-            elif random.random() < 0.7:
-                out = '{:.0f}'.format(random.random() * max_num)
-            else:
-                # Randomly retain 2 decimal places
-                out = str(random.random() *
-                          max_num)[:len(str(max_num)) + random.randint(0, 3)]
-            if type == 'm':
-                out = f'${out}'
-        elif (type == 'e'):
-            txt_len = random.randint(self.min_txt_len, self.max_txt_len)
-            out = self.generate_text(txt_len, self.en)
-            # 50% chance to capitalize the first letter
-            if random.random() < 0.5:
-                out[0] = out[0].upper()
-        elif type == 't':
-            out = ''
-        else:
-            txt_len = random.randint(self.min_txt_len, self.max_txt_len)
-            out = self.generate_text(txt_len, self.ch)
-        return ''.join(out)
-
-    def generate_text(self, txt_len, dict):
-        random_star_idx = random.randint(0, len(dict) - txt_len)
-        txt = dict[random_star_idx:random_star_idx + txt_len]
-        return list(txt)
-
     def agnostic_span_indices(self, maxvalue, max_num=3):
         '''Spans indices. Can be used for row or col span
         Span indices store the starting indices of row or col spans while span_lengths will store
@@ -202,19 +195,16 @@ class Table:
                 break
 
         # make first row span matric
-        row_span_indices = []
+        col_spanned = np.zeros(self.no_of_cols, dtype=bool)
         self.spanflag = True
         for index, length in zip(header_span_indices, header_span_lengths):
             self.col_spans_matrix[0, index] = length
             self.col_spans_matrix[0, index + 1:index + length] = -1
-            row_span_indices += list(range(index, index + length))
+            col_spanned[index:index + length] = True
 
         # for not span cols, set it to row span value 2
-        b = list(
-            filter(lambda x: x not in row_span_indices,
-                   list(range(self.no_of_cols))))
-        self.row_spans_matrix[0, b] = 2
-        self.row_spans_matrix[1, b] = -1
+        self.row_spans_matrix[0, ~col_spanned] = 2
+        self.row_spans_matrix[1, ~col_spanned] = -1
 
     def make_first_col_spans(self):
         '''To make some random row spans on first col of each row'''
@@ -228,7 +218,7 @@ class Table:
         for index, length in zip(span_indices, span_lengths):
             self.row_spans_matrix[index, colnumber] = length
             self.row_spans_matrix[index + 1:index + length, colnumber] = -1
-        self.headers[:, colnumber] = 'h'
+        self.header_mask[:, colnumber] = True
         self.header_count['c'] += 1
 
     def generate_missing_cells(self):
@@ -236,10 +226,10 @@ class Table:
         missing = np.random.random(size=(self.get_log_value(), 2))
         missing[:, 0] = (self.no_of_rows - 1 - self.header_count['r']
                          ) * missing[:, 0] + self.header_count['r']
-        missing[:, 1] = (self.no_of_rows - 1 - self.header_count['c']
+        missing[:, 1] = (self.no_of_cols - 1 - self.header_count['c']
                          ) * missing[:, 1] + self.header_count['c']
-        for arr in missing:
-            self.missing_cells.append((int(arr[0]), int(arr[1])))
+        missing = missing.astype(int)
+        self.missing_mask[missing[:, 0], missing[:, 1]] = True
 
     def create_border_style(self):
         if self.border_type =='full_line':
@@ -318,6 +308,7 @@ class Table:
                     }
                 }
             }
+            style = random.choice(list(partial_line_type.values()))
         else: # No line
             style = {
                     'name': 'no_border',
@@ -349,8 +340,17 @@ class Table:
         # Only need to set the height of the table header; don't need to set the height of the table data.
         # if self.cell_max_height != 0:
         #     td_style += f"height: {random.randint(self.cell_max_height // 2, self.cell_max_height)}px;"
+        width = 0
         if self.cell_max_width != 0:
-            td_style += f"width: {random.randint(self.cell_max_width // 4, self.cell_max_width)}px;"
+            width = random.randint(self.cell_max_width // 4, self.cell_max_width)
+            td_style += f"width: {width}px;"
+        # keep the chosen values for renderers that lay out the table themselves
+        self.td_layout = {
+            'vertical_align': vertical_align,
+            'padding': (pad_d_top, pad_d_bot, pad_d_left, pad_d_right),
+            'width': width,
+            'height': 0
+        }
         # Set border style
         if 'td' in border_style:
             td_style += border_style['td']
@@ -381,10 +381,19 @@ class Table:
         th_style += "word-break: break-word;"
         # Set limit size
         # Only need to set the height of the table header; don't need to set the height of the table data.
+        height = width = 0
         if self.cell_max_height != 0:
-            th_style += f"height: {random.randint(self.cell_max_height // 4, self.cell_max_height)}px;"
+            height = random.randint(self.cell_max_height // 4, self.cell_max_height)
+            th_style += f"height: {height}px;"
         if self.cell_max_width != 0:
-            th_style += f"width: {random.randint(self.cell_max_width // 4, self.cell_max_width)}px;"
+            width = random.randint(self.cell_max_width // 4, self.cell_max_width)
+            th_style += f"width: {width}px;"
+        self.th_layout = {
+            'vertical_align': vertical_align,
+            'padding': (pad_h_top, pad_h_bot, pad_h_left, pad_h_right),
+            'width': width,
+            'height': height
+        }
         # Set border style
         if 'th' in border_style:
             th_style += border_style['th']
@@ -406,12 +415,13 @@ class Table:
         font_text = random.choice(list_fonts)
         style += f'<font size="{font_size}" face="{font_text}" >'
         style += '<style>' 
+        css_start = len(style)
         style += "html{background-color: white;}"
         # Set style table
         style += "table{"
         # Set the text's horizontal alignment
-        style += "text-align:{};".format(
-            random.choices(['left', 'right', 'center'], weights=[0.3, 0.2, 0.5], k=1)[0])
+        text_align = random.choices(['left', 'right', 'center'], weights=[0.3, 0.2, 0.5], k=1)[0]
+        style += "text-align:{};".format(text_align)
         # Using style border-collapse: collapse
         # Check visualization: https://www.w3schools.com/cssref/tryit.php?filename=trycss_border-collapse
         style += "border-collapse: collapse;"
@@ -419,6 +429,10 @@ class Table:
         # # Set table style
         border_type = self.create_border_style()
         border_style = border_type['style']
+        self.font_size = font_size
+        self.font_face = font_text
+        self.text_align = text_align
+        self.border_style = border_style
         if 'table' in border_style:
             style += border_style['table']
         style += "}"
@@ -434,6 +448,8 @@ class Table:
         style += ".{} {{text-decoration: underline;}}".format(self.underline)
         style += ".{} {{font-style: italic;}}".format(self.italic)
         style += ".{} {{font-weight: bold;}}".format(self.bold)
+        # the stylesheet alone, to swap the style of a rendered table (see restyle)
+        self.css = style[css_start:]
 
         style += "</style></head>"
         return style
@@ -442,71 +458,95 @@ class Table:
         '''Depending on various conditions e.g. columns spanned, rows spanned, data types of columns,
         regular or irregular headers, tables types and border types, this function creates equivalent html
         script'''
-        idcounter = 0
+        style = self.create_style()
+        templates = cell_templates(self.cell_box_type, (self.italic, self.bold, self.underline))
+
+        # the emitted cells in id order and their plan
+        rows, cols = np.nonzero(self.emit_mask)
+        row_spans = self.row_spans_matrix[rows, cols].astype(int)
+        col_spans = self.col_spans_matrix[rows, cols].astype(int)
+        by_row = row_spans > 0
+        spans = np.where(by_row, row_spans, col_spans)
+        headers = self.header_mask[rows, cols]
+        effects = self.effects[rows, cols]
+        colored = self.color_mask[rows, cols]
+        template_index = cell_template_index(headers, effects, by_row, colored)
+        colors = [tuple(color) if c else None for color, c in zip(self.colors[rows, cols].tolist(), colored.tolist())]
+        texts = self.generate_texts(self.text_types[rows, cols])
+        ids = range(len(texts))
+
+        cell_html = [
+            templates[t].format(id=i, color=color, span=span, text=text)
+            for t, i, color, span, text in zip(template_index.tolist(), ids, colors, spans.tolist(), texts)
+        ]
+        cell_tokens = [('<td', f' rowspan="{span}"' if r else f' colspan="{span}"', '>', '</td>') if span > 1 else
+                       ('<td>', '</td>') for r, span in zip(by_row.tolist(), spans.tolist())]
+
+        # text of every cell id, as the browser reports it
+        self.cell_texts = [' '.join(txt.split()) for txt in texts]
+        # every emitted cell in id order, for renderers that lay out the table themselves
+        text_effects = ["", self.italic, self.bold, self.underline]
+        self.cells = [{
+            'row': row,
+            'col': col,
+            'rowspan': span if r else 1,
+            'colspan': 1 if r else max(span, 1),
+            'header': header,
+            'text': text,
+            'effect': text_effects[effect],
+            'color': color
+        } for row, col, r, span, header, effect, color, text in zip(rows.tolist(), cols.tolist(), by_row.tolist(),
+                                                                   spans.tolist(), headers.tolist(), effects.tolist(),
+                                                                   colors, texts)]
+
+        # rows are the slices of cells between these ids
+        ends = np.cumsum(np.bincount(rows, minlength=self.no_of_rows)).tolist()
+        starts = [0] + ends[:-1]
+        self.body_html = ''.join(['<body><table>'] + ['<tr>' + ''.join(cell_html[s:e]) + '</tr>'
+                                                      for s, e in zip(starts, ends)] + ["<table></body></html>"])
         structure = []
-        temparr = ['td', 'th']
-        html = "<!DOCTYPE html><html>"
-        html += self.create_style()
-        html += '<body><table>'
-        # html += '<table style="width: 100%; table-layout:fixed;">'
-        for r in range(self.no_of_rows):
-            html += '<tr>'
+        for s, e in zip(starts, ends):
             structure.append('<tr>')
-            for c in range(self.no_of_cols):
-                text_type = self.cell_types[r, c].decode('utf-8')
-                row_span_value = int(self.row_spans_matrix[r, c])
-                col_span_value = int(self.col_spans_matrix[r, c])
-                htmlcol = temparr[['s', 'h'].index(self.headers[r][c].decode('utf-8'))]
-                if self.cell_box_type == 'cell':
-                    htmlcol += f' id={idcounter}'
-                htmlcol_style = htmlcol
-                # set color
-                if ((col_span_value != 0) or (r, c) not in self.missing_cells) and random.random() < self.color_prob:
-                    color = (random.randint(200, 255), random.randint(200, 255), random.randint(200, 255))
-                    htmlcol_style += f' style="background-color: rgba({color[0]}, {color[1]}, {color[2]},1);"'
-                
-                # # Random text effect
-                text_effect = random.choice(["", self.italic, self.bold, self.underline])
-                htmlcol_style += f" class={text_effect}"
-
-                if (row_span_value == -1):
-                    continue
-                elif (row_span_value > 0):
-                    html += (f'<{htmlcol_style}' + ' rowspan=\"' + str(row_span_value)) + '">'
-
-                    if row_span_value > 1:
-                        structure.extend(('<td', f' rowspan=\"{row_span_value}\"', '>'))
-                    else:
-                        structure.append('<td>')
-                else:
-                    if col_span_value == -1:
-                        continue
-                    elif col_span_value == 0:
-                        if (r, c) in self.missing_cells:
-                            text_type = 't'
-                    html += (f'<{htmlcol_style}' + ' colspan=\"' + str(col_span_value)) + '">'
-
-                    if col_span_value > 1:
-                        structure.extend(('<td', f' colspan=\"{col_span_value}\"', '>'))
-                    else:
-                        structure.append('<td>')
-                if c == 0:
-                    # First line must be set to English or word, not a number
-                    text_type = 'e'
-                txt = self.generate_random_text(text_type)
-                if self.cell_box_type == 'text':
-                    txt = f'<span id={idcounter}>{txt} </span>'
-                idcounter += 1
-                html += f'{txt}</{htmlcol}>'
-                structure.append('</td>')
-
-            html += '</tr>'
+            for tokens in cell_tokens[s:e]:
+                structure.extend(tokens)
             structure.append('</tr>')
-        html += "<table></body></html>"
-        return html, structure, idcounter
+        return '<!DOCTYPE html><html>' + style + self.body_html, structure, len(texts)
+
+    def generate_texts(self, text_types):
+        '''generates the texts of many cells at once, each text type is drawn with one vectorized call. Text types
+        are c: chinese, e: english, n: number, m: money and t: empty'''
+        texts = [''] * len(text_types)
+        for type, corpus in (('e', self.en_corpus), ('c', self.ch_corpus)):
+            index = np.flatnonzero(text_types == type)
+            if len(index) == 0:
+                continue
+            lengths = np.random.randint(self.min_txt_len, self.max_txt_len + 1, size=len(index))
+            sampled = corpus.sample(lengths, self.word_boundary)
+            # 50% chance to capitalize the first letter of english text
+            capitalize = np.random.random(len(index)) < (0.5 if type == 'e' else 0)
+            for i, txt, upper in zip(index.tolist(), sampled, capitalize.tolist()):
+                texts[i] = txt[:1].upper() + txt[1:] if upper else txt
+        index = np.flatnonzero((text_types == 'n') | (text_types == 'm'))
+        for i, txt in zip(index.tolist(), sample_numbers(text_types[index] == 'm')):
+            texts[i] = txt
+        return texts
+
+    def restyle(self):
+        '''draws a new random style (font, alignment, padding, borders) for the created table and returns its
+        html, the structure, texts and cell attributes stay the same'''
+        return '<!DOCTYPE html><html>' + self.create_style() + self.body_html
 
     def create(self):
         '''This will create the complete table'''
+        self.plan()
+
+        # create equivalent html
+        html, structure, idcounter = self.create_html()
+
+        return idcounter, html, structure, self.border_type
+
+    def plan(self):
+        '''randomly decides column types, headers, missing cells and spans before the html is created'''
         self.define_col_types()  # define the data types for each column
         self.generate_missing_cells()  # generate missing cells
 
@@ -519,7 +559,20 @@ class Table:
         if self.max_span_row_count > 0 and random.random() < 0.5:
             self.make_first_col_spans()
 
-        # create equivalent html
-        html, structure, idcounter = self.create_html()
-
-        return idcounter, html, structure, self.border_type
+        self.plan_cells()
+
+    def plan_cells(self):
+        '''decides for all cells at once which are emitted and their text type, text effect and color'''
+        shape = (self.no_of_rows, self.no_of_cols)
+        row_spans, col_spans = self.row_spans_matrix, self.col_spans_matrix
+        # cells covered by the span of another cell are not emitted
+        self.emit_mask = (row_spans != -1) & ((row_spans > 0) | (col_spans != -1))
+        self.text_types = self.cell_types.copy()
+        self.text_types[(row_spans == 0) & (col_spans == 0) & self.missing_mask] = 't'
+        # First line must be set to English or word, not a number
+        self.text_types[:, 0] = 'e'
+        # index into '', italic, bold and underline
+        self.effects = np.random.randint(0, 4, size=shape)
+        # missing cells without a span are not colored
+        self.color_mask = ((col_spans != 0) | ~self.missing_mask) & (np.random.random(shape) < self.color_prob)
+        self.colors = np.random.randint(200, 256, size=shape + (3, ))
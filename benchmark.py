@@ -0,0 +1,150 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import resource
+import sys
+import tempfile
+import time
+from TableGeneration.GenerateTable import GenerateTable
+from TableGeneration.Corpus import Corpus
+from TableGeneration.Metrics import Metrics
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='time every stage of table generation')
+    parser.add_argument('--num', type=int, default=20, help='tables per configuration')
+    parser.add_argument('--ch_dict_path', type=str, default='dict/ch_news.txt')
+    parser.add_argument('--en_dict_path', type=str, default='dict/en_corpus.txt')
+    # sweep
+    parser.add_argument('--rows', type=str, default='5,20,40', help='comma separated row counts')
+    parser.add_argument('--cols', type=str, default='3,10,20', help='comma separated col counts')
+    parser.add_argument('--border_types', type=str, default='full_line,partial_line,no_line')
+    parser.add_argument('--cell_box_types', type=str, default='cell,text')
+    parser.add_argument('--renderers', type=str, default='raster,browser',
+                        help='browser configurations are skipped when no browser can be started')
+    # table and browser settings shared by every configuration
+    parser.add_argument('--max_txt_len', type=int, default=45)
+    parser.add_argument('--cell_max_width', type=int, default=480)
+    parser.add_argument('--browser', type=str, default='chrome')
+    parser.add_argument('--browser_width', type=int, default=4800)
+    parser.add_argument('--browser_height', type=int, default=3600)
+    parser.add_argument('--render_mode', type=str, default='inject', choices=['inject', 'navigate'])
+    parser.add_argument('--extract_mode', type=str, default='batch', choices=['batch', 'element'])
+    parser.add_argument('--screenshot_mode', type=str, default='clip', choices=['clip', 'full'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default=None, help='json report path, printed when not set')
+    return parser.parse_args()
+
+
+def peak_rss_mb():
+    '''peak memory of this process, every configuration runs in a fresh one (run_config)'''
+    # ru_maxrss is in KB on linux and in bytes on mac
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+
+
+def bench_config(args, renderer, border_type, cell_box_type, rows, cols, output):
+    t = GenerateTable(output=output,
+                      ch_dict_path=args.ch_dict_path,
+                      en_dict_path=args.en_dict_path,
+                      cell_box_type=cell_box_type,
+                      min_row=rows,
+                      max_row=rows,
+                      min_col=cols,
+                      max_col=cols,
+                      max_txt_len=args.max_txt_len,
+                      cell_max_width=args.cell_max_width,
+                      browser=args.browser,
+                      browser_width=args.browser_width,
+                      browser_height=args.browser_height,
+                      border_type=border_type,
+                      extract_mode=args.extract_mode,
+                      render_mode=args.render_mode,
+                      screenshot_mode=args.screenshot_mode,
+                      renderer=renderer,
+                      seed=args.seed)
+    timer = Metrics(keep_samples=True)
+    t.metrics = timer
+    browser_rss = 0
+    failed = 0
+    try:
+        if renderer == 'browser':
+            # start outside the timed loop, a worker keeps its browser for many tables
+            try:
+                with timer.time('browser_start'):
+                    t.start_browser()
+            except Exception as e:
+                # no browser or driver installed
+                return {'browser_error': repr(e)}
+        start = time.perf_counter()
+        for index in range(args.num):
+            # a table that fails is counted like generate_table does, it does not end the configuration
+            try:
+                t.seed_index(index)
+                with timer.time('table_plan'):
+                    table = t.create_table()
+                    table.plan()
+                with timer.time('create_html'):
+                    html_content, structure, id_count = table.create_html()
+                im, contens = t.render_table(table, html_content, id_count)
+                t.save_sample(index, (im, html_content, structure, contens, table.border_type), save_html=False)
+            except Exception as e:
+                t.record_failure(e)
+                failed += 1
+            if renderer == 'browser':
+                browser_rss = max(browser_rss, t.browser_rss())
+        elapsed = time.perf_counter() - start
+    finally:
+        t.close()
+    return {
+        'renderer': renderer,
+        'border_type': border_type,
+        'cell_box_type': cell_box_type,
+        'rows': rows,
+        'cols': cols,
+        'tables': args.num,
+        'tables_failed': failed,
+        'tables_per_sec': round((args.num - failed) / elapsed, 3),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'peak_browser_rss_mb': round(browser_rss, 1),
+        'stages': timer.summary()
+    }
+
+
+def run_config(args, *config):
+    '''benchmarks a configuration in a spawned process, so its peak memory is its own'''
+    # loaded before the timed loop, like every generator process does once
+    Corpus.get(args.en_dict_path).load()
+    return bench_config(args, *config)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    ctx = mp.get_context('spawn')
+    results = []
+    browser_error = None
+    with tempfile.TemporaryDirectory() as output:
+        for renderer in args.renderers.split(','):
+            for border_type in args.border_types.split(','):
+                for cell_box_type in args.cell_box_types.split(','):
+                    for rows in map(int, args.rows.split(',')):
+                        for cols in map(int, args.cols.split(',')):
+                            if renderer == 'browser' and browser_error is not None:
+                                continue
+                            print(f'{renderer} {border_type} {cell_box_type} {rows}x{cols}', file=sys.stderr)
+                            with ctx.Pool(1) as pool:
+                                result = pool.apply(run_config, (args, renderer, border_type, cell_box_type, rows,
+                                                                 cols, os.path.join(output, renderer)))
+                            if 'browser_error' in result:
+                                # no browser could be started, skip every browser configuration
+                                browser_error = result['browser_error']
+                                print(f'skipping browser: {browser_error}', file=sys.stderr)
+                                continue
+                            results.append(result)
+    report = {'args': vars(args), 'browser_skipped': browser_error, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
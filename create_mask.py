@@ -1,10 +1,16 @@
 import os
+from io import BytesIO
 from tqdm import tqdm
 import cv2
 import numpy as np
 import argparse
 import glob
 import json
+import multiprocessing as mp
+from multiprocessing.util import Finalize
+from PIL import Image
+from TableGeneration.Mask import cell_border_mask
+from TableGeneration.ShardWriter import ShardWriter
 
 def parse_line(info):
     file_name = info['filename']
@@ -18,52 +24,93 @@ def parse_line(info):
     return data
 
 
-def draw_bbox(img, points, color=(255, 0, 0), thickness=4):
-    img = img.copy()
-    y_min, x_min = img.shape[:2]
-    x_max, y_max = 0, 0
-    for point in points:
-        x1 = np.min(point[..., 0])
-        y1 = np.min(point[..., 1])
-        x2 = np.max(point[..., 0])
-        y2 = np.max(point[..., 1])
-        if x_min > x1: x_min = x1
-        if y_min > x1: y_min = y1
-        if x_max < x2: x_max = x2
-        if y_max < y2: y_max = y2
-        cv2.polylines(img, [point.astype(int)], True, color, thickness)
-    # table_polygon = [[x1, y1]]
-
-    cv2.rectangle(img, (x_min, y_min), (x_max, y_max), color=color, thickness=thickness)
-    return img
-
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('--image_dir', type=str, default='/mnt/ssd/techainer/table_project/TableGeneration/output/simple_table_02122022')
     parser.add_argument('--gt_dir', type=str, default='/mnt/ssd/techainer/table_project/TableGeneration/output/simple_table_02122022/json')
     parser.add_argument('--output_dir', type=str, default='/mnt/ssd/techainer/table_project/TableGeneration/output/simple_table_02122022')
+    parser.add_argument('--shard_dir', type=str, default=None,
+                        help='read labels and images from the shards (and manifests) of this directory instead of gt_dir')
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count(), help='number of process worker, 0 to run serially')
+    parser.add_argument('--thickness', type=int, default=4, help='thickness of the cell borders in the mask')
+    parser.add_argument('--output_format', type=str, default='files', choices=['files', 'shards'],
+                        help='files: one png per mask in output_dir/mask; shards: png masks in tar shards in output_dir/mask_shards')
+    parser.add_argument('--max_shard_size', type=int, default=1024, help='max size of a tar shard in MB')
     return parser.parse_args()
 
 
+def list_samples(args):
+    '''returns a task per sample: the path of its label file, or its manifest line when reading shards'''
+    if args.shard_dir is None:
+        return glob.glob(os.path.join(args.gt_dir, "*.json"))
+    tasks = []
+    for manifest in glob.glob(os.path.join(args.shard_dir, 'manifest_*.jsonl')):
+        with open(manifest, encoding='utf-8') as f:
+            tasks += [json.loads(line) for line in f if line.endswith('\n')]
+    return tasks
+
+
+def read_member(path, offset, size):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def load_sample(task):
+    '''returns the label and the (width, height) of the image of a task, without decoding the image'''
+    if isinstance(task, str):
+        with open(task, "rb") as f:
+            data = parse_line(json.load(f))
+        # PIL only reads the header until the pixels are accessed
+        with Image.open(os.path.join(args.image_dir, data['file_name'])) as im:
+            return data, im.size
+    shard_path = os.path.join(args.shard_dir, task['shard'])
+    data = parse_line(json.loads(read_member(shard_path, task['label_offset'], task['label_size'])))
+    with Image.open(BytesIO(read_member(shard_path, task['img_offset'], task['img_size']))) as im:
+        return data, im.size
+
+
+# every worker keeps its own shard writer, started by init_worker
+args = None
+writer = None
+
+
+def init_worker(worker_args):
+    global args, writer
+    args = worker_args
+    if args.output_format == 'shards':
+        writer = ShardWriter(os.path.join(args.output_dir, 'mask_shards'), f'mask_{os.getpid()}', args.max_shard_size,
+                             img_ext='png')
+        # close the shards when the pool shuts the worker down
+        Finalize(writer, writer.close, exitpriority=10)
+
+
+def create_mask(task):
+    data, (wid, hei) = load_sample(task)
+    boxes = [x['bbox'] for x in data['cells']]
+    mask = cell_border_mask(boxes, wid, hei, args.thickness)
+    name = os.path.splitext(os.path.basename(data['file_name']))[0]
+    if writer is not None:
+        writer.write(name, cv2.imencode('.png', mask)[1].tobytes(), {'filename': f'{name}.png'})
+        return
+    cv2.imwrite(os.path.join(args.output_dir, 'mask', f'{name}.png'), mask)
+
+
 if __name__ == '__main__':
     args = parse_args()
-    os.makedirs(args.output_dir, exist_ok=True)
-
-    list_gt_path = glob.glob(os.path.join(args.gt_dir, "*.json"))
-    
-    for gt_path in tqdm(list_gt_path):
-        with open(gt_path, "rb") as f:
-            data_lines = json.load(f)
-        data = parse_line(data_lines)
-        img_path = os.path.join(args.image_dir, data['file_name'])
-        raw_img = cv2.imread(img_path)
-
-        boxes = [np.array(x['bbox']) for x in data['cells']]
-        image_name = os.path.basename(img_path).replace("jpg", "png")
-        wid, hei = raw_img.shape[:2]
-        mask = np.zeros((wid, hei), dtype=np.uint8)
-        show_img = draw_bbox(mask, boxes)
-        output_dir = os.path.join(args.output_dir, 'mask')
-        os.makedirs(output_dir, exist_ok=True)
-        output_path = os.path.join(output_dir, image_name)
-        cv2.imwrite(output_path, show_img)
+    if args.output_format == 'files':
+        os.makedirs(os.path.join(args.output_dir, 'mask'), exist_ok=True)
+
+    tasks = list_samples(args)
+    if args.num_workers == 0:
+        init_worker(args)
+        for task in tqdm(tasks):
+            create_mask(task)
+        if writer is not None:
+            writer.close()
+    else:
+        pool = mp.Pool(args.num_workers, initializer=init_worker, initargs=(args, ))
+        for _ in tqdm(pool.imap_unordered(create_mask, tasks, chunksize=64), total=len(tasks)):
+            pass
+        pool.close()
+        pool.join()
@@ -1,9 +1,17 @@
 import argparse
+import glob
+import json
+import os
 import sys
-from TableGeneration.GenerateTable import GenerateTable
+from TableGeneration.GenerateTable import GenerateTable, mark_run, reap_orphan_browsers
+from TableGeneration.Corpus import Corpus
+from TableGeneration.Pipeline import Stalled, run_pipeline
+from TableGeneration.RenderServer import RenderServer
+from TableGeneration.Metrics import Metrics, serve_metrics
 import multiprocessing as mp
+from multiprocessing.util import Finalize
 from tqdm import tqdm
-from datetime import date
+from datetime import date, datetime
 
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -19,8 +27,9 @@ def parse_args():
                         choices=['full_line', 'partial_line', 'no_line'],
                         help='cell: use cell location as cell box; text: use location of text in cell as cell box')
     # cell box type
-    parser.add_argument('--cell_box_type', type=str, default='cell',
-                        help='cell: use cell location as cell box; text: use location of text in cell as cell box')
+    parser.add_argument('--cell_box_type', type=str, default='cell', choices=['cell', 'text', 'both'],
+                        help='cell: use cell location as cell box; text: use location of text in cell as cell box; '
+                        'both: write cell boxes as bbox and text boxes as text_bbox')
     # row and col
     parser.add_argument('--min_row', type=int, default=3, help='min rows in table')
     parser.add_argument('--max_row', type=int, default=40, help='max rows in table')
@@ -33,86 +42,367 @@ def parse_args():
     # txts lens
     parser.add_argument('--min_txt_len', type=int, default=2, help='min number of char in cell')
     parser.add_argument('--max_txt_len', type=int, default=45, help='max number of char in cell')
+    parser.add_argument('--word_boundary', action='store_true',
+                        help='cut cell texts from the corpora at word boundaries instead of at random characters')
     # color
     parser.add_argument('--color_prob', type=float, default=0, help='the prob of color cell')
     # cell size
     parser.add_argument('--cell_max_width', type=int, default=480, help='max width of cell')
     parser.add_argument('--cell_max_height', type=int, default=0, help='max height of cell')
     # windows size
-    parser.add_argument('--browser_width', type=int, default=4800, help='width of browser')
-    parser.add_argument('--browser_height', type=int, default=3600, help='height of browser')
+    parser.add_argument('--browser_width', type=int, default=4800, help='width of browser, tables are laid out this wide')
+    parser.add_argument('--browser_height', type=int, default=1080,
+                        help='initial height of browser, the window or capture grows to fit long tables')
+    parser.add_argument('--max_page_width', type=int, default=9600,
+                        help='tables wider than the browser are laid out in a wider window up to this width')
+    parser.add_argument('--max_page_height', type=int, default=16384,
+                        help='tables laid out larger than max_page_width x max_page_height are dropped and recorded')
     parser.add_argument('--browser', type=str, default='chrome', help='chrome or firefox')
     parser.add_argument('--num_workers', type=int, default=8, help='number of process worker')
+    parser.add_argument('--extract_mode', type=str, default='batch', choices=['batch', 'element'],
+                        help='batch: read all cell boxes with one script call; element: query cells one by one')
+    parser.add_argument('--render_mode', type=str, default='inject', choices=['inject', 'navigate'],
+                        help='inject: swap every table into one loaded page; navigate: load every table as a data url')
+    parser.add_argument('--screenshot_mode', type=str, default='clip', choices=['clip', 'full'],
+                        help='clip: capture only the padded table region (chrome only); full: capture the whole window')
+    parser.add_argument('--screenshot_format', type=str, default='png', choices=['png', 'jpeg'],
+                        help='encoding of clipped captures, jpeg captures are saved without re-encoding')
+    parser.add_argument('--targets', type=str, default='',
+                        help='comma separated targets written with every image from its boxes: mask (cell borders '
+                        'like create_mask.py), row, col, span (maps of the cell grid)')
+    parser.add_argument('--structure_only', action='store_true',
+                        help='only write structure tokens, cell texts and gt to structure.jsonl, without rendering')
+    parser.add_argument('--renderer', type=str, default='browser', choices=['browser', 'raster'],
+                        help='browser: render html with selenium; raster: lay out and draw tables with PIL, no browser needed')
+    parser.add_argument('--font_path', type=str, default=None, help='ttf font of the raster renderer')
+    parser.add_argument('--bold_font_path', type=str, default=None, help='bold ttf font of the raster renderer')
+    # reproducibility
+    parser.add_argument('--seed', type=int, default=None,
+                        help='derive the random state of every table from this seed and its index')
+    parser.add_argument('--resume', action='store_true',
+                        help='only generate the indices missing in output, which is used as given without a date suffix')
+    # pipeline
+    parser.add_argument('--pipeline', action='store_true',
+                        help='create, render and write tables in separate process stages connected by bounded queues')
+    parser.add_argument('--num_producers', type=int, default=1, help='processes creating tables in pipeline mode')
+    parser.add_argument('--num_renderers', type=int, default=8, help='processes rendering tables in pipeline mode')
+    parser.add_argument('--num_encoders', type=int, default=2, help='processes encoding and writing tables in pipeline mode')
+    parser.add_argument('--queue_size', type=int, default=64, help='max tables waiting between two pipeline stages')
+    # metrics
+    parser.add_argument('--metrics_dir', type=str, default=None,
+                        help='every process periodically writes its stage timers and counters to metrics_dir/<run_id> '
+                        'in prometheus text format')
+    parser.add_argument('--run_id', type=str, default=None,
+                        help='id of this run, defaults to the start time and pid. Names its metrics subdirectory and '
+                        'tags its browsers, only tagged browsers of dead workers are killed')
+    parser.add_argument('--metrics_interval', type=int, default=10, help='seconds between two metrics flushes')
+    parser.add_argument('--metrics_port', type=int, default=0,
+                        help='serve the summed metrics of this run at http://localhost:port/metrics, 0 to disable')
+    # output
+    parser.add_argument('--output_format', type=str, default='files', choices=['files', 'shards'],
+                        help='files: one image, html and json file per table; shards: tar shards with jsonl labels and a manifest')
+    parser.add_argument('--max_shard_size', type=int, default=1024, help='max size of a tar shard in MB')
+    # browser recycling
+    parser.add_argument('--max_tables_per_browser', type=int, default=1000,
+                        help='restart the browser of a worker after this many tables, 0 to never restart')
+    parser.add_argument('--max_browser_rss', type=int, default=2048,
+                        help='restart the browser of a worker once it uses more than this many MB, 0 to disable')
+    # hang recovery
+    parser.add_argument('--render_timeout', type=int, default=120,
+                        help='kill and restart the browser when rendering one table takes more seconds, 0 to disable')
+    parser.add_argument('--task_timeout', type=int, default=600,
+                        help='restart the worker pool or pipeline when no table finished for this many seconds, 0 to disable')
+    parser.add_argument('--retries', type=int, default=1, help='times failed indices are generated again')
+    parser.add_argument('--tiles_per_page', type=int, default=1,
+                        help='tables the browser renders on one page and captures with one screenshot (not in pipeline mode)')
+    parser.add_argument('--style_variants', type=int, default=1,
+                        help='render every table under this many styles, written as <border>_<index>_v<k> (not in pipeline mode)')
+    # render server
+    parser.add_argument('--serve', type=str, default=None,
+                        help='run a render server at this unix socket path or host:port instead of generating, with '
+                        'num_workers browsers tiling up to tiles_per_page tables of its clients per page')
+    parser.add_argument('--render_server', type=str, default=None,
+                        help='render tables with the render server at this address instead of a browser per worker')
 
     args = parser.parse_args()
     if args.browser == 'chrome' and sys.platform == 'darwin':
         print('firefox is recommend for Mac OS, bug you choice is chrome')
         sys.exit(0)
+    args.run_id = args.run_id or f'{datetime.now().strftime("%Y%m%d_%H%M%S")}_{os.getpid()}'
+    if args.metrics_dir:
+        # files of earlier runs in metrics_dir are not summed into this one
+        args.metrics_dir = os.path.join(args.metrics_dir, args.run_id)
     return args
 
 
+def build_generator(args, output):
+    t = GenerateTable(output=output,
+                      ch_dict_path=args.ch_dict_path,
+                      en_dict_path=args.en_dict_path,
+                      cell_box_type=args.cell_box_type,
+                      min_row=args.min_row,
+                      max_row=args.max_row,
+                      min_col=args.min_col,
+                      max_col=args.max_col,
+                      min_txt_len=args.min_txt_len,
+                      max_txt_len=args.max_txt_len,
+                      max_span_row_count=args.max_span_row_count,
+                      max_span_col_count=args.max_span_col_count,
+                      max_span_value=args.max_span_value,
+                      color_prob=args.color_prob,
+                      cell_max_width=args.cell_max_width,
+                      cell_max_height=args.cell_max_height,
+                      browser=args.browser,
+                      browser_width=args.browser_width,
+                      browser_height=args.browser_height,
+                      border_type=args.border_type,
+                      max_tables_per_browser=args.max_tables_per_browser,
+                      max_browser_rss=args.max_browser_rss,
+                      extract_mode=args.extract_mode,
+                      render_mode=args.render_mode,
+                      screenshot_mode=args.screenshot_mode,
+                      screenshot_format=args.screenshot_format,
+                      renderer=args.renderer,
+                      font_path=args.font_path,
+                      bold_font_path=args.bold_font_path,
+                      output_format=args.output_format,
+                      max_shard_size=args.max_shard_size,
+                      seed=args.seed,
+                      render_timeout=args.render_timeout,
+                      tiles_per_page=args.tiles_per_page,
+                      style_variants=args.style_variants,
+                      word_boundary=args.word_boundary,
+                      max_page_width=args.max_page_width,
+                      max_page_height=args.max_page_height,
+                      targets=[x for x in args.targets.split(',') if x],
+                      render_server=args.render_server)
+    if args.metrics_dir:
+        # one file per process, pool workers and pipeline stages build their generator in their own process
+        t.metrics = Metrics(os.path.join(args.metrics_dir, f'{os.getpid()}.prom'), args.metrics_interval)
+    return t
+
+
+def preload_corpus(args):
+    '''reads the corpora once in the parent process, forked workers then share them instead of reading their own'''
+    for path in (args.ch_dict_path, args.en_dict_path):
+        if os.path.exists(path):
+            Corpus.get(path).load()
+
+
+# every pool worker owns one long-lived generator (and browser), started by init_worker
+worker = None
+
+
+def get_output(args):
+    # runs with pool workers write to a date stamped directory, resumed runs continue the given one
+    if args.num_workers == 0 or args.resume:
+        return args.output
+    return f'{args.output}_{date.today().strftime("%d%m%Y")}'
+
+
+def init_worker(worker_args):
+    global worker
+    worker = build_generator(worker_args, get_output(worker_args))
+    # quit the browser when the pool shuts the worker down
+    Finalize(worker, worker.close, exitpriority=10)
+
+
 def gen(index):
+    '''returns the index and None or the exception type it failed with'''
     try:
-        output = f'{args.output}_{date.today().strftime("%d%m%Y")}'
-        t = GenerateTable(output=output,
-                        ch_dict_path=args.ch_dict_path,
-                        en_dict_path=args.en_dict_path,
-                        cell_box_type=args.cell_box_type,
-                        min_row=args.min_row,
-                        max_row=args.max_row,
-                        min_col=args.min_col,
-                        max_col=args.max_col,
-                        min_txt_len=args.min_txt_len,
-                        max_txt_len=args.max_txt_len,
-                        max_span_row_count=args.max_span_row_count,
-                        max_span_col_count=args.max_span_col_count,
-                        max_span_value=args.max_span_value,
-                        color_prob=args.color_prob,
-                        cell_max_width=args.cell_max_width,
-                        cell_max_height=args.cell_max_height,
-                        browser=args.browser,
-                        browser_width=args.browser_width,
-                        browser_height=args.browser_height,
-                        border_type=args.border_type)
-
-        t.gen_table_img_single(index)
-        t.close()
-    except KeyboardInterrupt:
-        t.close()
-    except Exception:
-        t.close()
+        return index, worker.gen_table_img_single(index)
+    except Exception as e:
+        worker.record_failure(e)
+        return index, type(e).__name__
+
+
+def gen_batch(indices):
+    '''gen for tables tiled on one page, returns (index, error) of every index'''
+    try:
+        return worker.gen_table_img_batch(indices)
+    except Exception as e:
+        worker.record_failure(e)
+        return [(index, type(e).__name__) for index in indices]
+
+
+def start_pool(args, indices):
+    '''starts a worker pool on indices, returns an iterator of [(index, error)] lists that raises Stalled
+    when no table finished for task_timeout seconds, and stop(terminate) to shut the pool down'''
+    pool = mp.Pool(args.num_workers, initializer=init_worker, initargs=(args, ))
+    tiled = (args.tiles_per_page > 1 and args.renderer == 'browser' and args.render_server is None
+             and args.style_variants == 1)
+    tasks = indices
+    if tiled:
+        tasks = [tasks[i:i + args.tiles_per_page] for i in range(0, len(tasks), args.tiles_per_page)]
+    results = pool.imap_unordered(gen_batch if tiled else gen, tasks)
+
+    def iterate():
+        for _ in range(len(tasks)):
+            try:
+                result = results.next(timeout=args.task_timeout or None)
+            except mp.TimeoutError:
+                raise Stalled(f'no table finished for {args.task_timeout}s') from None
+            yield result if tiled else [result]
+
+    def stop(terminate):
+        if terminate:
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+
+    return iterate(), stop
+
+
+def start_pipeline(args, indices):
+    '''start_pool for the pipeline mode'''
+    done = run_pipeline(build_generator, (args, get_output(args)),
+                        indices,
+                        num_producers=args.num_producers,
+                        num_renderers=args.num_renderers,
+                        num_encoders=args.num_encoders,
+                        queue_size=args.queue_size,
+                        task_timeout=args.task_timeout)
+    results = ([(index, None if ok else 'failed')] for index, ok in done)
+    # closing the generator terminates the stages that are still running
+    return results, lambda terminate: done.close()
+
+
+def run_indices(args, indices, desc):
+    '''generates indices with a worker pool or the pipeline, returns {index: error} of the failed ones. A run in
+    which no table finished for task_timeout seconds (or a pipeline stage died) is wedged beyond the watchdog
+    of its workers, it is terminated and the unfinished indices go to a new one'''
+    start = start_pipeline if args.pipeline else start_pool
+    pending = set(indices)
+    failed = {}
+    restarts = 0
+    progress = tqdm(total=len(pending), desc=desc)
+    while pending:
+        results, stop = start(args, sorted(pending))
+        try:
+            for result in results:
+                for index, error in result:
+                    pending.discard(index)
+                    if error is not None:
+                        failed[index] = error
+                    progress.update()
+        except Stalled as e:
+            stop(terminate=True)
+            reap_orphan_browsers(args.run_id)
+            restarts += 1
+            print(f'{e}, restarting ({len(pending)} left)')
+            if restarts > args.retries:
+                failed.update((index, 'PoolTimeout') for index in pending)
+                break
+            continue
+        stop(terminate=False)
+    progress.close()
+    return failed
+
+
+def write_failed(args, failed):
+    '''lists the indices that still failed after all retries, a --resume run generates them again'''
+    output = get_output(args)
+    os.makedirs(output, exist_ok=True)
+    with open(os.path.join(output, 'failed.jsonl'), 'w', encoding='utf-8') as f:
+        for index, error in sorted(failed.items()):
+            f.write(json.dumps({'index': index, 'error': error}) + '\n')
+    if failed:
+        print(f'{len(failed)} tables failed, see {os.path.join(output, "failed.jsonl")}')
+
+
+def gen_structure(index):
+    return json.dumps(worker.gen_table_structure(index), ensure_ascii=False)
+
+
+def gen_structure_labels(args, indices):
+    '''creates tables without a browser and writes one label per line'''
+    output = get_output(args)
+    os.makedirs(output, exist_ok=True)
+    if args.num_workers == 0:
+        init_worker(args)
+        lines = map(gen_structure, indices)
+    else:
+        pool = mp.Pool(args.num_workers, initializer=init_worker, initargs=(args, ))
+        lines = pool.imap_unordered(gen_structure, indices, chunksize=256)
+    with open(os.path.join(output, 'structure.jsonl'), 'a' if args.resume else 'w', encoding='utf-8') as f:
+        for line in tqdm(lines, total=len(indices), desc="Generating "):
+            f.write(line + '\n')
+    if args.num_workers != 0:
+        pool.close()
+        pool.join()
+
+
+def read_jsonl_names(path, key):
+    '''returns the key of every complete line of a jsonl file, a partly written last line is cut off'''
+    names = []
+    with open(path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end != len(data):
+            f.truncate(end)
+    for line in data[:end].decode('utf-8').splitlines():
+        names.append(json.loads(line)[key])
+    return names
+
+
+def find_done_indices(output, border_type, style_variants=1):
+    '''returns the indices output already holds, from label files, shard manifests or structure labels. With
+    style variants an index is done once its last variant is written'''
+    names = []
+    json_dir = os.path.join(output, 'json')
+    if os.path.isdir(json_dir):
+        names += [os.path.splitext(name)[0] for name in os.listdir(json_dir)]
+    for manifest in glob.glob(os.path.join(output, 'shards', 'manifest_*.jsonl')):
+        names += read_jsonl_names(manifest, 'name')
+    structure_path = os.path.join(output, 'structure.jsonl')
+    if os.path.exists(structure_path):
+        names += read_jsonl_names(structure_path, 'filename')
+    done = set()
+    last_variant = f'_v{style_variants - 1}'
+    for name in names:
+        if style_variants > 1:
+            if not name.endswith(last_variant):
+                continue
+            name = name[:-len(last_variant)]
+        border, _, index = name.rpartition('_')
+        if border == border_type and index.isdigit():
+            done.add(int(index))
+    return done
+
+
+def get_indices(args):
+    if not args.resume:
+        return list(range(args.num))
+    style_variants = 1 if args.structure_only else args.style_variants
+    done = find_done_indices(get_output(args), args.border_type, style_variants)
+    indices = [i for i in range(args.num) if i not in done]
+    print(f'resume: {args.num - len(indices)} tables done, {len(indices)} to generate')
+    return indices
 
 
 if __name__ == '__main__':
-    global args
     args = parse_args()
-    if args.num_workers == 0:
-        t = GenerateTable(output=args.output,
-                          ch_dict_path=args.ch_dict_path,
-                          en_dict_path=args.en_dict_path,
-                          cell_box_type=args.cell_box_type,
-                          min_row=args.min_row,
-                          max_row=args.max_row,
-                          min_col=args.min_col,
-                          max_col=args.max_col,
-                          min_txt_len=args.min_txt_len,
-                          max_txt_len=args.max_txt_len,
-                          max_span_row_count=args.max_span_row_count,
-                          max_span_col_count=args.max_span_col_count,
-                          max_span_value=args.max_span_value,
-                          color_prob=args.color_prob,
-                          cell_max_width=args.cell_max_width,
-                          cell_max_height=args.cell_max_height,
-                          browser=args.browser,
-                          browser_width=args.browser_width,
-                          browser_height=args.browser_height,
-                          border_type=args.border_type)
-
-        t.gen_table_img(args.num)
+    mark_run(args.run_id)
+    preload_corpus(args)
+    indices = get_indices(args)
+    if args.metrics_dir and args.metrics_port:
+        serve_metrics(args.metrics_dir, args.metrics_port)
+    if args.serve:
+        RenderServer(args.serve, build_generator, (args, args.output), num_browsers=args.num_workers,
+                     max_batch=args.tiles_per_page).serve_forever()
+    elif args.structure_only:
+        gen_structure_labels(args, indices)
+    elif args.num_workers == 0 and not args.pipeline:
+        t = build_generator(args, args.output)
+        t.gen_table_img(args.num, indices)
         t.close()
-    
+
     else:
-        pool = mp.Pool(args.num_workers)
-        output = list(tqdm(pool.imap_unordered(gen, range(args.num)),
-                            total=args.num, desc="Generating "))
-        pool.terminate()
\ No newline at end of file
+        failed = run_indices(args, indices, "Generating ")
+        for attempt in range(args.retries):
+            if not failed:
+                break
+            failed = run_indices(args, sorted(failed), f"Retry {attempt + 1} ")
+        write_failed(args, failed)
+        reap_orphan_browsers(args.run_id)
@@ -0,0 +1,59 @@
+import numpy as np
+from TableGeneration.Corpus import Corpus, sample_numbers
+
+
+def make_corpus(tmp_path, lines):
+    path = tmp_path / 'corpus.txt'
+    path.write_text('\n'.join(lines), encoding='utf-8')
+    return Corpus(str(path))
+
+
+def test_sample_lengths(tmp_path):
+    corpus = make_corpus(tmp_path, ['the quick brown fox', 'jumps over the lazy dog'])
+    np.random.seed(0)
+    lengths = np.random.randint(1, 20, size=500)
+    texts = corpus.sample(lengths)
+    assert [len(text) for text in texts] == lengths.tolist()
+    assert all(text in corpus.text for text in texts)
+
+
+def test_sample_longer_than_text(tmp_path):
+    corpus = make_corpus(tmp_path, ['abc'])
+    assert corpus.sample([10]) == ['abc']
+
+
+def test_sample_word_boundary(tmp_path):
+    corpus = make_corpus(tmp_path, ['supercalifragilistic the quick brown fox', 'jumps over the lazy dog'])
+    words = set(corpus.text.split())
+    np.random.seed(0)
+    lengths = np.random.randint(2, 15, size=500)
+    for text, length in zip(corpus.sample(lengths, word_boundary=True), lengths.tolist()):
+        start = corpus.text.find(text)
+        assert start == 0 or corpus.text[start - 1] == ' '
+        assert len(text) <= length
+        if not set(text.split()) <= words:
+            # only a word longer than the length is cut
+            assert len(text) == length and ' ' not in text
+
+
+def test_sample_word_boundary_long_first_word(tmp_path):
+    corpus = make_corpus(tmp_path, ['supercalifragilistic the quick brown fox'])
+    np.random.seed(0)
+    texts = corpus.sample([5] * 200, word_boundary=True)
+    # the first word is cut to the length instead of running to the end of the text
+    assert 'super' in texts
+    assert max(len(text) for text in texts) == 5
+
+
+def test_sample_numbers():
+    np.random.seed(0)
+    money = np.random.random(20000) < 0.3
+    texts = sample_numbers(money)
+    assert [text.startswith('$') for text in texts] == money.tolist()
+    values = np.array([float(text.lstrip('$')) for text in texts])
+    assert values.min() >= 0 and values.max() < 10000
+    two_decimals = np.mean([len(text.split('.')[-1]) == 2 and '.' in text for text in texts])
+    no_decimals = np.mean(['.' not in text for text in texts])
+    # two decimals are drawn half of the time, the cut off numbers sometimes have them as well
+    assert 0.48 < two_decimals < 0.58
+    assert 0.33 < no_decimals < 0.45
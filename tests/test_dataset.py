@@ -0,0 +1,60 @@
+import os
+import numpy as np
+import pytest
+from PIL import Image
+from TableGeneration.Dataset import TableDataset, WorkerError
+
+
+class FakeGenerator:
+    '''makes blank tables instead of rendering them, die_at kills the worker at that index'''
+
+    def __init__(self, die_at=None, fail_at=None):
+        self.seed = 0
+        self.die_at = die_at
+        self.fail_at = fail_at
+
+    def make_sample(self, index):
+        if index == self.die_at:
+            os._exit(3)
+        if index == self.fail_at:
+            raise ValueError('no table')
+        return Image.new('RGB', (index + 1, 2), 'white'), {'filename': f'full_{index}.jpg'}
+
+    def close(self):
+        pass
+
+
+def fail_build():
+    raise OSError('no browser')
+
+
+def names(samples):
+    return sorted(label['filename'] for _, label in samples)
+
+
+@pytest.mark.parametrize('num_workers', [0, 1, 3])
+def test_all_indices(num_workers):
+    dataset = TableDataset(FakeGenerator, num_workers=num_workers, prefetch=2, start=5, num=10)
+    samples = list(dataset)
+    assert names(samples) == sorted(f'full_{i}.jpg' for i in range(5, 15))
+    assert all(im.size == (int(label['filename'][5:-4]) + 1, 2) for im, label in samples)
+
+
+def test_as_array():
+    im, label = next(iter(TableDataset(FakeGenerator, num_workers=1, num=1, as_array=True)))
+    assert isinstance(im, np.ndarray) and im.shape == (2, 1, 3)
+
+
+def test_build_failure_raises():
+    with pytest.raises(WorkerError, match='no browser'):
+        list(TableDataset(fail_build, num_workers=2, num=10))
+
+
+def test_table_failure_outside_a_sample_raises():
+    with pytest.raises(WorkerError, match='no table'):
+        list(TableDataset(FakeGenerator, (None, 3), num_workers=2, num=10))
+
+
+def test_dead_worker_raises():
+    with pytest.raises(WorkerError, match='exit code 3'):
+        list(TableDataset(FakeGenerator, (4, ), num_workers=2, num=10))
@@ -0,0 +1,90 @@
+import os
+import cv2
+import numpy as np
+from TableGeneration.GenerateTable import GenerateTable
+from TableGeneration.Mask import boxes_to_rects, cell_border_mask, cell_grid, draw_borders, structure_maps
+
+DICT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dict')
+
+
+def polylines_mask(rects, width, height, thickness=4):
+    mask = np.zeros((height, width), dtype=np.uint8)
+    for x0, y0, x1, y1 in rects:
+        points = np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]]).reshape(-1, 1, 2)
+        cv2.polylines(mask, [points], True, 255, thickness)
+    return mask
+
+
+def corner_pixels(rects, width, height, thickness=4):
+    '''pixels around the corners, where cv2.polylines rounds and draw_borders is square'''
+    near = np.zeros((height, width), dtype=bool)
+    half = thickness // 2
+    for x0, y0, x1, y1 in rects:
+        for x, y in ((x0, y0), (x1, y0), (x1, y1), (x0, y1)):
+            near[max(y - half, 0):y + half + 1, max(x - half, 0):x + half + 1] = True
+    return near
+
+
+def test_draw_borders_matches_polylines():
+    rng = np.random.RandomState(0)
+    width, height = 200, 150
+    xs = np.sort(rng.randint(-5, width + 5, size=(40, 2)), axis=1)
+    ys = np.sort(rng.randint(-5, height + 5, size=(40, 2)), axis=1)
+    rects = np.stack([xs[:, 0], ys[:, 0], xs[:, 1], ys[:, 1]], axis=1)
+    mask = draw_borders(rects, width, height)
+    reference = polylines_mask(rects, width, height)
+    corners = corner_pixels(rects, width, height)
+    assert mask.dtype == np.uint8 and set(np.unique(mask)) <= {0, 255}
+    assert np.array_equal(mask[~corners], reference[~corners])
+    # square corners cover the round ones
+    assert np.all(mask[reference > 0] == 255)
+
+
+def test_thin_rects():
+    # rects thinner than the outline and a single point are filled
+    rects = [[10, 10, 11, 40], [20, 20, 20, 20]]
+    mask = draw_borders(rects, 50, 50)
+    assert np.all(mask[polylines_mask(rects, 50, 50) > 0] == 255)
+    assert mask[25, 10] == 255 and mask[25, 11] == 255 and mask[20, 20] == 255
+    assert mask[30, 30] == 0 and mask[25, 14] == 0
+
+
+def test_cell_border_mask_outlines_table():
+    boxes = [[[[10, 10], [50, 10], [50, 30], [10, 30]]], [[[50, 10], [90, 10], [90, 30], [50, 30]]]]
+    assert boxes_to_rects(boxes).tolist() == [[10, 10, 50, 30], [50, 10, 90, 30]]
+    mask = cell_border_mask(boxes, 100, 40)
+    assert np.array_equal(mask, draw_borders([[10, 10, 50, 30], [50, 10, 90, 30], [10, 10, 90, 30]], 100, 40))
+
+
+def test_cell_grid_spans():
+    structure = ['<thead>', '<tr>', '<td', ' rowspan="2"', '>', '</td>', '<td', ' colspan="2"', '>', '</td>', '</tr>',
+                 '</thead>', '<tbody>', '<tr>', '<td>', '</td>', '<td>', '</td>', '</tr>',
+                 '<tr>', '<td>', '</td>', '<td', ' colspan="2"', ' rowspan="1"', '>', '</td>', '</tr>', '</tbody>']
+    assert cell_grid(structure).tolist() == [[0, 0, 2, 1], [0, 1, 1, 2], [1, 1, 1, 1], [1, 2, 1, 1],
+                                             [2, 0, 1, 1], [2, 1, 1, 2]]
+
+
+def test_cell_grid_of_generated_tables():
+    generator = GenerateTable(None, os.path.join(DICT_DIR, 'ch_news.txt'), os.path.join(DICT_DIR, 'en_corpus.txt'),
+                              renderer='raster', seed=0)
+    for index in range(50):
+        generator.seed_index(index)
+        table = generator.create_table()
+        _, _, structure, _ = table.create()
+        covered = np.zeros((table.no_of_rows, table.no_of_cols), dtype=int)
+        for row, col, rowspan, colspan in cell_grid(structure).tolist():
+            covered[row:row + rowspan, col:col + colspan] += 1
+        # every position of the table belongs to exactly one cell
+        assert np.all(covered == 1)
+
+
+def test_structure_maps():
+    structure = ['<tr>', '<td', ' colspan="2"', '>', '</td>', '</tr>', '<tr>', '<td>', '</td>', '<td>', '</td>',
+                 '</tr>']
+    boxes = [[[[0, 0], [9, 0], [9, 4], [0, 4]]], [[[0, 5], [4, 5], [4, 9], [0, 9]]],
+             [[[5, 5], [9, 5], [9, 9], [5, 9]]]]
+    maps = structure_maps(boxes, structure, 12, 10)
+    assert maps['row'].dtype == np.uint16 and maps['row'].shape == (10, 12)
+    assert maps['row'][2, 2] == 1 and maps['row'][7, 2] == 2 and maps['row'][7, 11] == 0
+    assert maps['col'][2, 8] == 1 and maps['col'][7, 2] == 1 and maps['col'][7, 7] == 2
+    assert maps['span'][2, 2] == 255 and maps['span'][7, 7] == 0
@@ -0,0 +1,52 @@
+import os
+import pytest
+from TableGeneration.GenerateTable import GenerateTable, TableTooLarge
+
+DICT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dict')
+
+
+def make_generator(**kwargs):
+    return GenerateTable(None, os.path.join(DICT_DIR, 'ch_news.txt'), os.path.join(DICT_DIR, 'en_corpus.txt'),
+                         renderer='raster', seed=0, **kwargs)
+
+
+def render(generator, index):
+    generator.seed_index(index)
+    table = generator.create_table()
+    table.create()
+    return generator.raster_renderer.render(table)
+
+
+def assert_boxes_inside(im, contens):
+    for conten in contens:
+        for box in conten[2:]:
+            assert all(0 <= x <= im.width and 0 <= y <= im.height for x, y in box)
+
+
+def test_shrunk_tables_fit_the_window():
+    # wide tables that are shrunk to the window, like the benchmark sweep
+    generator = make_generator(browser_width=4800, browser_height=3600, min_col=20, max_col=20, min_row=5,
+                               max_row=5, max_txt_len=45, cell_max_width=480)
+    for index in range(40):
+        im, contens = render(generator, index)
+        assert im.width <= 4800
+        assert_boxes_inside(im, contens)
+
+
+@pytest.mark.parametrize('cell_box_type', ['cell', 'text', 'both'])
+def test_canvas_holds_the_table(cell_box_type):
+    generator = make_generator(cell_box_type=cell_box_type, browser_width=800, browser_height=400,
+                               max_page_width=2000, max_page_height=3000, max_row=30)
+    heights = []
+    for index in range(30):
+        im, contens = render(generator, index)
+        heights.append(im.height)
+        assert_boxes_inside(im, contens)
+    # taller tables than the window are not cut at its height
+    assert max(heights) > 400
+
+
+def test_page_cap():
+    generator = make_generator(browser_width=800, browser_height=200, min_row=20, max_row=20)
+    with pytest.raises(TableTooLarge):
+        render(generator, 0)
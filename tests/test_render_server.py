@@ -0,0 +1,101 @@
+import multiprocessing as mp
+import os
+import time
+import pytest
+from PIL import Image
+from TableGeneration.RenderServer import RemoteRenderError, RenderClient, RenderServer
+
+
+class FakeGenerator:
+    '''renders an html_content of a width as a blank image of that width, 'fail', 'die' and 'slow' misbehave'''
+
+    def __init__(self):
+        self.cell_box_type = 'cell'
+        self.last_error = None
+
+    def html_to_img(self, html_content, id_count):
+        if html_content == 'fail':
+            raise ValueError('bad table')
+        if html_content == 'die':
+            os._exit(1)
+        if html_content == 'slow':
+            time.sleep(3)
+            html_content = '1'
+        return Image.new('RGB', (int(html_content), 2), 'white'), [[id_count, self.cell_box_type]]
+
+    def html_to_tiles(self, samples):
+        # a table that fails on a tiled page is a missing tile
+        return [None if html_content == 'fail' else self.html_to_img(html_content, id_count)
+                for id_count, html_content in samples]
+
+    def run_with_watchdog(self, render, *args):
+        return render(*args)
+
+    def record_failure(self, error):
+        self.last_error = type(error).__name__
+
+    def recycle_browser(self, tables=1):
+        pass
+
+    def close(self):
+        pass
+
+
+def serve(address, max_batch):
+    RenderServer(address, FakeGenerator, (), num_browsers=2, max_batch=max_batch).serve_forever()
+
+
+@pytest.fixture(params=[1, 4], ids=['single', 'tiled'])
+def server(request, tmp_path):
+    address = str(tmp_path / 'render.sock')
+    # not a daemon, the server starts browser processes of its own
+    p = mp.Process(target=serve, args=(address, request.param))
+    p.start()
+    for _ in range(100):
+        if os.path.exists(address):
+            break
+        time.sleep(0.05)
+    yield address
+    p.terminate()
+    p.join(10)
+
+
+def test_render(server):
+    client = RenderClient(server)
+    im, contens = client.render('3', 7, 'text')
+    assert im.size == (3, 2) and contens == [[7, 'text']]
+    results = client.render_many([(str(width), width) for width in range(1, 21)])
+    assert [im.size[0] for im, _ in results] == list(range(1, 21))
+    client.close()
+
+
+def test_failed_render(server):
+    client = RenderClient(server)
+    results = client.render_many([('2', 0), ('fail', 1), ('4', 2)])
+    assert isinstance(results[1], RemoteRenderError) and str(results[1]) in ('ValueError', 'TileError')
+    assert results[0][0].size == (2, 2) and results[2][0].size == (4, 2)
+    client.close()
+
+
+def test_dead_worker(server):
+    client = RenderClient(server)
+    with pytest.raises(RemoteRenderError, match='WorkerDied'):
+        client.render('die', 0)
+    # the worker was replaced
+    assert client.render('5', 0)[0].size == (5, 2)
+    client.close()
+
+
+def test_client_timeout(server):
+    client = RenderClient(server, timeout=0.5)
+    with pytest.raises(RemoteRenderError, match='no reply'):
+        client.render('slow', 0)
+    client.timeout = 10
+    # a new connection, the late reply of the slow render is not taken for this one
+    assert client.render('6', 0)[0].size == (6, 2)
+    client.close()
+
+
+def test_server_gone(tmp_path):
+    with pytest.raises(RemoteRenderError):
+        RenderClient(str(tmp_path / 'render.sock')).render('1', 0)
@@ -0,0 +1,36 @@
+import json
+import os
+from generate_data import find_done_indices, read_jsonl_names
+
+
+def test_read_jsonl_names_cuts_partial_line(tmp_path):
+    path = tmp_path / 'manifest_w0.jsonl'
+    path.write_bytes(b'{"name": "full_0"}\n{"name": "full_1"}\n{"name": "fu')
+    assert read_jsonl_names(str(path), 'name') == ['full_0', 'full_1']
+    # the partial line is gone, so lines appended by the resumed run start on a line of their own
+    assert path.read_bytes() == b'{"name": "full_0"}\n{"name": "full_1"}\n'
+
+
+def test_read_jsonl_names_without_newline(tmp_path):
+    path = tmp_path / 'structure.jsonl'
+    path.write_bytes(b'{"filename": "full_0.jpg"')
+    assert read_jsonl_names(str(path), 'filename') == []
+    assert path.read_bytes() == b''
+
+
+def test_find_done_indices(tmp_path):
+    os.makedirs(tmp_path / 'json')
+    for name in ('full_0', 'full_2', 'partial_line_3', 'full_x'):
+        (tmp_path / 'json' / f'{name}.json').write_text('{}')
+    os.makedirs(tmp_path / 'shards')
+    lines = [json.dumps({'name': name}) for name in ('full_5', 'partial_line_6')]
+    (tmp_path / 'shards' / 'manifest_w0.jsonl').write_text('\n'.join(lines) + '\n{"name": "full_7')
+    assert find_done_indices(str(tmp_path), 'full') == {0, 2, 5}
+    assert find_done_indices(str(tmp_path), 'partial_line') == {3, 6}
+
+
+def test_find_done_indices_style_variants(tmp_path):
+    os.makedirs(tmp_path / 'json')
+    for name in ('full_0_v0', 'full_0_v1', 'full_0_v2', 'full_1_v0', 'full_1_v1'):
+        (tmp_path / 'json' / f'{name}.json').write_text('{}')
+    assert find_done_indices(str(tmp_path), 'full', style_variants=3) == {0}
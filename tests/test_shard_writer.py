@@ -0,0 +1,65 @@
+import json
+import os
+import tarfile
+from TableGeneration.ShardWriter import ShardWriter
+
+
+def read_manifest(output, prefix):
+    with open(os.path.join(output, f'manifest_{prefix}.jsonl'), encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def read_member(path, offset, size):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def test_offsets(tmp_path):
+    writer = ShardWriter(str(tmp_path), 'w0')
+    samples = []
+    for i in range(5):
+        img = bytes([i]) * (700 * i + 1)
+        label = {'filename': f'table_{i}.jpg', 'text': 'é' * i}
+        extra = {'mask.png': b'm' * (i + 3)}
+        samples.append((img, label, extra))
+        label_size = len(json.dumps(label, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        assert writer.write(f'table_{i}', img, label, extra) == len(img) + label_size + i + 3
+    # listed samples are readable before the writer is closed
+    entries = read_manifest(str(tmp_path), 'w0')
+    assert len(entries) == 5
+    writer.close()
+    for entry, (img, label, extra) in zip(entries, samples):
+        path = os.path.join(str(tmp_path), entry['shard'])
+        assert read_member(path, entry['img_offset'], entry['img_size']) == img
+        assert json.loads(read_member(path, entry['label_offset'], entry['label_size'])) == label
+        offset, size = entry['extra']['mask.png']
+        assert read_member(path, offset, size) == extra['mask.png']
+    with tarfile.open(os.path.join(str(tmp_path), entries[0]['shard'])) as tar:
+        assert tar.getnames()[:3] == ['table_0.jpg', 'table_0.json', 'table_0.mask.png']
+
+
+def test_rollover(tmp_path):
+    # shards of about 10 KB
+    writer = ShardWriter(str(tmp_path), 'w0', max_shard_size=10 / 1024)
+    for i in range(10):
+        writer.write(f'table_{i}', b'x' * 3000, {'filename': f'table_{i}.jpg'})
+    writer.close()
+    entries = read_manifest(str(tmp_path), 'w0')
+    shards = sorted({entry['shard'] for entry in entries})
+    assert shards == [f'w0_{n:05d}.tar' for n in range(len(shards))] and len(shards) > 1
+    for shard in shards:
+        # a shard is closed at the first sample after it reached the size
+        assert os.path.getsize(os.path.join(str(tmp_path), shard)) < 10 * 1024 + 3000 + 4 * tarfile.RECORDSIZE
+        with open(os.path.join(str(tmp_path), shard.replace('.tar', '.jsonl')), encoding='utf-8') as f:
+            assert [json.loads(line)['filename'] for line in f] == [
+                f"{entry['name']}.jpg" for entry in entries if entry['shard'] == shard]
+
+
+def test_no_overwrite(tmp_path):
+    for run in range(2):
+        writer = ShardWriter(str(tmp_path), 'w0')
+        writer.write(f'table_{run}', b'x', {'filename': f'table_{run}.jpg'})
+        writer.close()
+    entries = read_manifest(str(tmp_path), 'w0')
+    assert [entry['shard'] for entry in entries] == ['w0_00000.tar', 'w0_00001.tar']
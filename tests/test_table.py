@@ -0,0 +1,49 @@
+import os
+from html.parser import HTMLParser
+import pytest
+from TableGeneration.GenerateTable import GenerateTable
+from TableGeneration.Mask import cell_grid
+
+DICT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dict')
+
+
+class CellParser(HTMLParser):
+    '''collects the id, rowspan, colspan and text span id of every cell of the table'''
+
+    def __init__(self):
+        super().__init__()
+        self.cells = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag in ('td', 'th'):
+            self.cells.append({
+                'id': attrs.get('id'),
+                'rowspan': int(attrs.get('rowspan') or 1) or 1,
+                'colspan': int(attrs.get('colspan') or 1) or 1,
+                'span_id': None
+            })
+        elif tag == 'span' and self.cells:
+            self.cells[-1]['span_id'] = attrs.get('id')
+
+
+@pytest.mark.parametrize('cell_box_type', ['cell', 'text', 'both'])
+def test_html_matches_structure(cell_box_type):
+    generator = GenerateTable(None, os.path.join(DICT_DIR, 'ch_news.txt'), os.path.join(DICT_DIR, 'en_corpus.txt'),
+                              cell_box_type=cell_box_type, color_prob=0.5, renderer='raster', seed=0)
+    for index in range(30):
+        generator.seed_index(index)
+        table = generator.create_table()
+        id_count, html, structure, _ = table.create()
+        parser = CellParser()
+        parser.feed(html)
+        grid = cell_grid(structure).tolist()
+        assert len(parser.cells) == len(grid) == id_count
+        assert [(cell['rowspan'], cell['colspan']) for cell in parser.cells] == [(r, c) for _, _, r, c in grid]
+        ids = [str(i) for i in range(id_count)]
+        if cell_box_type in ('cell', 'both'):
+            assert [cell['id'] for cell in parser.cells] == ids
+        if cell_box_type == 'text':
+            assert [cell['span_id'] for cell in parser.cells] == ids
+        if cell_box_type == 'both':
+            assert [cell['span_id'] for cell in parser.cells] == ['t' + i for i in ids]
@@ -0,0 +1,64 @@
+import os
+from TableGeneration.GenerateTable import GenerateTable, TableTooLarge
+
+DICT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dict')
+BOX = [[0, 0], [10, 0], [10, 5], [0, 5]]
+
+
+def make_generator(**kwargs):
+    generator = GenerateTable(None, os.path.join(DICT_DIR, 'ch_news.txt'), os.path.join(DICT_DIR, 'en_corpus.txt'),
+                              tiles_per_page=3, seed=0, **kwargs)
+    # no browser: the render calls are replaced by the tests
+    generator.recycle_browser = lambda tables=1: None
+    return generator
+
+
+def test_rects_to_contens():
+    generator = make_generator(cell_box_type='both')
+    contens = generator.rects_to_contens([[' a b ', 1.4, 2.6, 10.2, 5.7, 3, 4, 2, 1], ['', 0, 0, 0, 0]])
+    assert contens[0] == [3, 'a b', [[1, 3], [11, 3], [11, 8], [1, 8]], [[3, 4], [5, 4], [5, 5], [3, 5]]]
+    assert contens[1] == [0, '', [[0, 0], [0, 0], [0, 0], [0, 0]]]
+
+
+def test_failed_tile_fails_alone():
+    generator = make_generator()
+    generator.html_to_tiles = lambda samples: [('im', [[1, 'a', BOX]]), None, ('im', [[1, 'b', BOX]])]
+    results = generator.generate_tables([0, 1, 2])
+    assert [error for _, error in results] == [None, 'TileError', None]
+    assert results[0][0][3] == [[1, 'a', BOX]] and results[1][0] is None
+
+
+def test_failed_page_fails_the_batch():
+    generator = make_generator()
+
+    def html_to_tiles(samples):
+        raise RuntimeError('browser gone')
+
+    generator.html_to_tiles = html_to_tiles
+    assert generator.generate_tables([0, 1]) == [(None, 'RuntimeError'), (None, 'RuntimeError')]
+
+
+class TallPageDriver:
+    '''a browser whose tile page is taller than any cap'''
+
+    def execute_script(self, script, *args):
+        return [0, 0, 500, 100000]
+
+
+def test_too_large_page_renders_tables_alone():
+    generator = make_generator(browser_height=1000)
+    generator.driver = TallPageDriver()
+    generator.window_size = {'width': generator.browser_width, 'height': 1000}
+    rendered = []
+
+    def html_to_img(html_content, id_count):
+        rendered.append(id_count)
+        if len(rendered) == 2:
+            raise TableTooLarge('too tall on its own')
+        return 'im', [[1, 'a', BOX]]
+
+    generator.html_to_img = html_to_img
+    results = generator.generate_tables([0, 1, 2])
+    assert len(rendered) == 3
+    assert [error for _, error in results] == [None, 'TableTooLarge', None]
+    assert results[0][0] is not None and results[2][0] is not None
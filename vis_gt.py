@@ -1,22 +1,24 @@
 import os
+import glob
+import json
+import random
+from itertools import islice
 from tqdm import tqdm
 import cv2
 import numpy as np
 import argparse
+import multiprocessing as mp
 
 
 def parse_line(data_dir, line):
-    import os, json
-    data_line = line.decode('utf-8').strip("\n")
-    info = json.loads(data_line)
+    if isinstance(line, bytes):
+        line = line.decode('utf-8')
+    info = json.loads(line)
     file_name = info['filename']
     cells = info['html']['cells'].copy()
     structure = info['html']['structure']['tokens'].copy()
 
     img_path = os.path.join(data_dir, file_name)
-    if not os.path.exists(img_path):
-        print(img_path)
-        return None
     data = {
         'img_path': img_path,
         'cells': cells,
@@ -26,13 +28,11 @@ def parse_line(data_dir, line):
     return data
 
 
-def draw_bbox(img_path, points, color=(255, 0, 0), thickness=2):
-    if isinstance(img_path, str):
-        img_path = cv2.imread(img_path)
-    img_path = img_path.copy()
+def draw_bbox(img, points, color=(255, 0, 0), thickness=2):
+    '''draws the boxes onto img in place'''
     for point in points:
-        cv2.polylines(img_path, [point.astype(int)], True, color, thickness)
-    return img_path
+        cv2.polylines(img, [point.reshape(-1, 1, 2).astype(int)], True, color, thickness)
+    return img
 
 
 def rebuild_html(data):
@@ -68,57 +68,185 @@ def skip_char(text, sp_char_list):
 
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--image_dir', type=str)
-    parser.add_argument('--gt_path', type=str)
+    parser.add_argument('--image_dir', type=str, help='directory the filename of the labels is relative to')
+    parser.add_argument('--gt_path', type=str, default=None, help='label file with one json label per line')
+    parser.add_argument('--gt_dir', type=str, default=None, help='directory of json label files, like output/json')
+    parser.add_argument('--shard_dir', type=str, default=None,
+                        help='read labels and images from the shards (and manifests) of this directory')
+    parser.add_argument('--save_dir', type=str, default=None, help='defaults to show next to the labels')
+    parser.add_argument('--limit', type=int, default=0, help='stop after this many samples, 0: all')
+    parser.add_argument('--sample_rate', type=float, default=1.0,
+                        help='keep every sample with this probability, with limit reading stops once limit are kept')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the sampling')
+    parser.add_argument('--page_size', type=int, default=100, help='samples per html page')
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count(), help='number of process worker, 0 to run serially')
     return parser.parse_args()
 
 
-if __name__ == '__main__':
-    args = parse_args()
-    label_file_path = args.gt_path
-
-    with open(label_file_path, "rb") as f:
-        data_lines = f.readlines()
-
-    save_dir = os.path.split(label_file_path)[0] + '/show'
-    os.makedirs(save_dir + '/imgs', exist_ok=True)
-
-    f_html = open(os.path.join(save_dir, 'show.html'), 'w')
-    f_html.write('<html>\n<body>\n')
-    f_html.write('<table border="1">\n')
-    f_html.write(
-        "<meta http-equiv=\"Content-Type\" content=\"text/html; charset=utf-8\" />"
-    )
-    f_html.write("<tr>\n")
-    f_html.write('<td>img name\n')
-    f_html.write('<td>ori image</td>')
-    f_html.write('<td>structure</td>')
-    f_html.write('<td>box</td>')
-    f_html.write("</tr>\n")
-
-    for i, line in tqdm(enumerate(data_lines)):
-        data = parse_line(args.image_dir, data_lines[i])
-
-        if data is None:
-            continue
-        img = cv2.imread(data['img_path'])
-        img_name = ''.join(os.path.basename(data['file_name']).split('.')[:-1])
-        img_save_name = os.path.join(save_dir, 'imgs', img_name)
-        cv2.imwrite(img_save_name + '.jpg', img)
+def read_member(path, offset, size):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def stream_tasks(args):
+    '''lazily yields a task per sample: a label line, a label file path or a manifest entry of a shard'''
+    if args.shard_dir is not None:
+        for manifest in sorted(glob.glob(os.path.join(args.shard_dir, 'manifest_*.jsonl'))):
+            with open(manifest, encoding='utf-8') as f:
+                for line in f:
+                    if line.endswith('\n'):
+                        yield line
+    elif args.gt_dir is not None:
+        for entry in os.scandir(args.gt_dir):
+            if entry.name.endswith('.json'):
+                yield entry.path
+    else:
+        with open(args.gt_path, 'rb') as f:
+            yield from f
+
+
+def sample_tasks(args, tasks):
+    '''keeps every task with probability sample_rate and at most limit of them, tasks are only parsed by the
+    workers, so skipped samples cost a line read at most'''
+    if args.sample_rate < 1:
+        rng = random.Random(args.seed)
+        tasks = (task for task in tasks if rng.random() < args.sample_rate)
+    if args.limit > 0:
+        tasks = islice(tasks, args.limit)
+    return tasks
+
+
+def load_sample(task):
+    '''returns the label and the decoded image of a task, or None when the image is missing'''
+    if args.shard_dir is not None:
+        entry = json.loads(task)
+        shard_path = os.path.join(args.shard_dir, entry['shard'])
+        data = parse_line(args.shard_dir, read_member(shard_path, entry['label_offset'], entry['label_size']))
+        img_bytes = read_member(shard_path, entry['img_offset'], entry['img_size'])
+        return data, img_bytes
+    if args.gt_dir is not None:
+        with open(task, 'rb') as f:
+            data = parse_line(args.image_dir, f.read())
+    else:
+        data = parse_line(args.image_dir, task)
+    if not os.path.exists(data['img_path']):
+        print(data['img_path'])
+        return None
+    return data, None
 
-        boxes = [np.array(x['bbox']) for x in data['cells']]
-        show_img = draw_bbox(data['img_path'], boxes)
-        cv2.imwrite(img_save_name + '_show.jpg', show_img)
 
-        html = rebuild_html(data)
+# set by init_worker in every pool worker
+args = None
+
+
+def init_worker(worker_args):
+    global args
+    args = worker_args
 
-        f_html.write("<tr>\n")
-        f_html.write(f'<td> imgs/{img_name}.jpg <br/>\n')
-        f_html.write(f'<td><img src="imgs/{img_name}.jpg" width=640></td>')
-        f_html.write('<td><table  border="1">' + html + '</table></td>')
-        f_html.write(
-            f'<td><img src="imgs/{img_name}_show.jpg" width=640></td>')
 
+def show_sample(task):
+    '''draws the boxes of one sample onto its only decode and returns its html row, or None'''
+    sample = load_sample(task)
+    if sample is None:
+        return None
+    data, img_bytes = sample
+    img_name = os.path.splitext(os.path.basename(data['file_name']))[0]
+    if img_bytes is None:
+        img = cv2.imread(data['img_path'])
+        # link the original image instead of writing a copy
+        ori_src = os.path.relpath(data['img_path'], args.save_dir)
+    else:
+        img = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_COLOR)
+        ori_src = os.path.join('imgs', os.path.basename(data['file_name']))
+        with open(os.path.join(args.save_dir, ori_src), 'wb') as f:
+            f.write(img_bytes)
+
+    draw_bbox(img, [np.array(x['bbox']) for x in data['cells']])
+    text_boxes = [np.array(x['text_bbox']) for x in data['cells'] if 'text_bbox' in x]
+    draw_bbox(img, text_boxes, color=(0, 160, 0), thickness=1)
+    cv2.imwrite(os.path.join(args.save_dir, 'imgs', f'{img_name}_show.jpg'), img)
+
+    html = rebuild_html(data)
+    return ''.join([
+        "<tr>\n",
+        f'<td> {data["file_name"]} <br/>\n',
+        f'<td><img src="{ori_src}" width=640></td>',
+        '<td><table  border="1">' + html + '</table></td>',
+        f'<td><img src="imgs/{img_name}_show.jpg" width=640></td>',
+        "</tr>\n"
+    ])
+
+
+def page_name(page):
+    return f'show_{page:05d}.html'
+
+
+def write_page(save_dir, page, rows, last):
+    links = []
+    if page > 0:
+        links.append(f'<a href="{page_name(page - 1)}">prev</a>')
+    if not last:
+        links.append(f'<a href="{page_name(page + 1)}">next</a>')
+    links = ' '.join(links)
+    with open(os.path.join(save_dir, page_name(page)), 'w', encoding='utf-8') as f_html:
+        f_html.write('<html>\n<body>\n')
+        f_html.write("<meta http-equiv=\"Content-Type\" content=\"text/html; charset=utf-8\" />")
+        f_html.write(f'<p>page {page} {links}</p>\n')
+        f_html.write('<table border="1">\n')
+        f_html.write("<tr>\n")
+        f_html.write('<td>img name\n')
+        f_html.write('<td>ori image</td>')
+        f_html.write('<td>structure</td>')
+        f_html.write('<td>box</td>')
         f_html.write("</tr>\n")
-    f_html.write('</table></body></html>')
-    f_html.close()
+        f_html.writelines(rows)
+        f_html.write(f'</table>\n<p>{links}</p></body></html>')
+
+
+def write_pages(save_dir, rows, page_size):
+    '''writes the rows into pages of page_size rows, keeping only one page in memory'''
+    page = 0
+    buffered = []
+    for row in rows:
+        if row is None:
+            continue
+        if len(buffered) == page_size:
+            write_page(save_dir, page, buffered, last=False)
+            page += 1
+            buffered = []
+        buffered.append(row)
+    write_page(save_dir, page, buffered, last=True)
+    return page + 1
+
+
+def chunked(tasks, size):
+    tasks = iter(tasks)
+    while True:
+        chunk = list(islice(tasks, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.save_dir is None:
+        source = args.shard_dir or args.gt_dir or os.path.split(args.gt_path)[0]
+        args.save_dir = os.path.join(source, 'show')
+    os.makedirs(os.path.join(args.save_dir, 'imgs'), exist_ok=True)
+
+    tasks = sample_tasks(args, stream_tasks(args))
+    if args.num_workers == 0:
+        rows = map(show_sample, tasks)
+        pool = None
+    else:
+        pool = mp.Pool(args.num_workers, initializer=init_worker, initargs=(args, ))
+        # the pool takes its tasks a bounded chunk at a time, so the label stream is never read ahead in full
+        chunks = chunked(tasks, args.num_workers * 64)
+        rows = (row for chunk in chunks for row in pool.imap(show_sample, chunk, chunksize=8))
+    pages = write_pages(args.save_dir, tqdm(rows), args.page_size)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    print(f'{pages} pages in {os.path.join(args.save_dir, page_name(0))}')